@@ -3,55 +3,67 @@ app.py : Main
 """
 
 ## Streamlit & UI
+import importlib
+
 import streamlit as st
 from streamlit_option_menu import option_menu
-from PIL import Image
-
-## Importing pages
-from content.intro import introduction
-from content.exploration import exploration
-from content.preparation import preparation
-from content.visualisation import visualisation
-from content.modelisation import modelisation
-from content.resources import resources
-
-## Page title & favicon
-st.set_page_config(page_title = "Retail Sales Analysis", page_icon = "images/favicon.png")
-
-## Sidebar menu
-with st.sidebar:
-    image_side = Image.open("images/trolley.png")
-    st.image(image_side)
-    st.header("Walmart Sales Prediction")
-    choice = option_menu(
-        menu_title = "Summary",
-        options = ["Introduction",
-                   "Data Exploration",
-                   "Data Processing",
-                   "Analysis and visualization",
-                   "Modeling and prediction",
-                   "Resources"],
-        default_index = 0)
-
-    # Author
-    st.header("Author :")
-    st.markdown('Christophe NORET&nbsp;&nbsp;[<img src="https://content.linkedin.com/content/dam/me/business/en-us/amp/brand-site/v2/bg/LI-Bug.svg.original.svg" width=25>](http://www.linkedin.com/in/christophenoret) [<img src="https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png" width=25>](https://github.com/cnoret)', unsafe_allow_html=True)
-
-## Main Menu
-if choice == "Introduction":
-    introduction()
-
-elif choice == "Data Exploration":
-    exploration()
-
-elif choice == "Data Processing":
-    preparation()
-
-elif choice == "Analysis and visualization":
-    visualisation()
-
-elif choice == "Modeling and prediction":
-    modelisation()
-
-else:
-    resources()
+
+from utils.instrument import panel_enabled, performance_panel, profiled, profilers, setup_logging, stage, start_run
+
+## Page registry: menu entry -> (module, function)
+# Page modules (and the heavy libraries they use: scikit-learn, seaborn, matplotlib...)
+# are only imported when their page is opened
+PAGES = {
+    "Introduction": ("content.intro", "introduction"),
+    "Data Exploration": ("content.exploration", "exploration"),
+    "Data Processing": ("content.preparation", "preparation"),
+    "Analysis and visualization": ("content.visualisation", "visualisation"),
+    "Modeling and prediction": ("content.modelisation", "modelisation"),
+    "Store forecasts": ("content.forecasting", "forecasting"),
+    "Resources": ("content.resources", "resources"),
+}
+
+
+def main():
+    "Render the page chosen in the sidebar menu"
+    ## Page title & favicon
+    st.set_page_config(page_title = "Retail Sales Analysis", page_icon = "images/favicon.png")
+
+    ## Sidebar menu
+    with st.sidebar:
+        st.image("images/trolley.png")
+        st.header("Walmart Sales Prediction")
+        choice = option_menu(
+            menu_title = "Summary",
+            options = list(PAGES),
+            default_index = 0)
+
+        # Author
+        st.header("Author :")
+        st.markdown('Christophe NORET&nbsp;&nbsp;[<img src="https://content.linkedin.com/content/dam/me/business/en-us/amp/brand-site/v2/bg/LI-Bug.svg.original.svg" width=25>](http://www.linkedin.com/in/christophenoret) [<img src="https://github.githubassets.com/images/modules/logos_page/GitHub-Mark.png" width=25>](https://github.com/cnoret)', unsafe_allow_html=True)
+
+    ## Performance panel (hidden: open the app with ?perf=1, or set RETAIL_PERF=1)
+    setup_logging()
+    show_panel = panel_enabled()
+    profiler = None
+    if show_panel:
+        profiler = st.sidebar.selectbox("Profile this run", [None] + profilers(),
+                                        format_func = lambda name: name or "No profiling")
+
+    ## Main Menu
+    module_name, function_name = PAGES[choice]
+    start_run(choice)
+    with profiled(profiler) as profile:
+        with stage('import'):
+            page = getattr(importlib.import_module(module_name), function_name)
+        with stage('page'):
+            page()
+
+    if show_panel:
+        performance_panel(profile['report'])
+
+
+## Worker processes spawned by the pages (utils.workers) import this script as __mp_main__:
+# only the Streamlit run renders a page
+if __name__ != '__mp_main__':
+    main()
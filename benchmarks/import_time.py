@@ -0,0 +1,56 @@
+"""
+Benchmark : cold-start import time of the Streamlit app
+
+Usage : python benchmarks/import_time.py [--runs N]
+
+Every scenario is timed in fresh Python processes (so nothing is already imported).
+"Eager" is what app.py used to import at startup (every page module); the other
+scenarios are what it imports now: the app shell plus the page being opened.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SHELL = ['streamlit', 'streamlit_option_menu', 'utils.instrument']
+PAGES = {
+    "Introduction": 'content.intro',
+    "Data Exploration": 'content.exploration',
+    "Data Processing": 'content.preparation',
+    "Analysis and visualization": 'content.visualisation',
+    "Modeling and prediction": 'content.modelisation',
+    "Store forecasts": 'content.forecasting',
+    "Resources": 'content.resources',
+}
+
+SCENARIOS = {"Eager (all pages, before)": SHELL + list(PAGES.values()),
+             **{f"Lazy: {name}": SHELL + [module] for name, module in PAGES.items()}}
+
+
+def import_seconds(modules):
+    "Wall-clock time to import `modules` in a fresh interpreter"
+    code = ("import time; start = time.perf_counter()\n"
+            + "".join(f"import {module}\n" for module in modules)
+            + "print(time.perf_counter() - start)")
+    result = subprocess.run([sys.executable, '-c', code], cwd = ROOT, capture_output = True,
+                            text = True, check = True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measure the cold-start import time of the app.")
+    parser.add_argument('--runs', type = int, default = 5, help = "fresh processes per scenario")
+    args = parser.parse_args()
+
+    print(f"{'Scenario':<42}{'median (s)':>12}{'min (s)':>10}")
+    for name, modules in SCENARIOS.items():
+        times = [import_seconds(modules) for _ in range(args.runs)]
+        print(f"{name:<42}{statistics.median(times):>12.3f}{min(times):>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Benchmark : data loading, preparation, aggregation and modeling steps
+
+Usage : python benchmarks/pipeline.py [--scales 1 10 100] [--repeat N] [--forest-max-scale S]
+                                     [--output FILE] [--compare FILE]
+
+Every stage runs on the shipped data/ files (scale 1) and on synthetic chains from
+utils.synthetic with `scale` times the shipped stores (scale 10 = 10 times the stores,
+rows and file sizes). When data/sales.csv is not shipped, scale 1 is a synthetic chain
+too. Each stage reports its median wall time over `--repeat`
+runs and its peak traced memory (one extra run under tracemalloc). Results can be
+saved as JSON and compared with a previous run, e.g. from another commit.
+
+The Random Forest stages fit and query the model as the modeling page does (grown in
+batches on scaled features, then saved to the registry as a scaler + forest pipeline);
+they only run up to `--forest-max-scale` (default 1), a fit taking minutes beyond.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from utils.aggregates import build_aggregates
+from utils.encoding import encode_columns
+from utils.loader import SALES_DTYPES, FEATURES_DTYPES, STORES_DTYPES
+from utils.pipeline import fill_missing_features, parse_dates, merge_datasets
+from utils.schema import compact
+from utils.synthetic import generate
+from utils.training import FOREST_PRESETS, MODEL_FEATURES, grow_forest, make_boosting, make_forest
+
+SHIPPED_DIR = os.path.join(ROOT, "data")
+FILES = {'sales': ("sales.csv", SALES_DTYPES), 'features': ("features.csv", FEATURES_DTYPES),
+         'stores': ("stores.csv", STORES_DTYPES)}
+
+PREDICT_CALLS = 200
+FOREST_PRESET = list(FOREST_PRESETS)[0]
+FOREST_STAGES = ['fit_forest', 'predict_single_forest', 'predict_batch_forest']
+
+
+## Datasets
+
+def read_tables(directory):
+    "Raw (sales, features, stores) of a data directory, with the loader's schemas"
+    return tuple(pd.read_csv(os.path.join(directory, name), dtype = dtype) for name, dtype in FILES.values())
+
+
+def shipped_stores():
+    "Number of stores of the shipped data"
+    return len(pd.read_csv(os.path.join(SHIPPED_DIR, FILES['stores'][0])))
+
+
+def dataset(scale, tmp):
+    """(name, directory) of the data for a scale: the shipped files at scale 1 when they
+    include sales.csv, otherwise a synthetic chain with `scale` times the shipped stores"""
+    if scale == 1 and os.path.exists(os.path.join(SHIPPED_DIR, FILES['sales'][0])):
+        return 'shipped', SHIPPED_DIR
+    directory = os.path.join(tmp, f'x{scale}')
+    generate(directory, shipped_stores() * scale)
+    return f'synthetic-x{scale}', directory
+
+
+## Stages: name -> function(state) updating the shared state
+# predict_single(_forest) is PREDICT_CALLS one-row predict calls (the latency of interactive predictions)
+
+def stage_load_csv(state):
+    state['raw'] = read_tables(state['directory'])
+
+
+def stage_prepare_merge(state):
+    sales, features, stores = state['raw']
+    state['merged'] = merge_datasets(parse_dates(sales), parse_dates(fill_missing_features(features)), stores)
+
+
+def stage_compact(state):
+    state['compact'] = compact(state['merged'])
+
+
+def stage_aggregates(state):
+    build_aggregates(state['merged'])
+
+
+def stage_encode(state):
+    data = state['compact']
+    state['X'] = encode_columns(data[MODEL_FEATURES], MODEL_FEATURES)
+    state['y'] = data['Weekly_Sales']
+
+
+def stage_fit_linear(state):
+    state['linear'] = LinearRegression().fit(state['X'], state['y'])
+
+
+def stage_fit_boosting(state):
+    state['boosting'] = make_boosting(state['X']).fit(state['X'], state['y'])
+
+
+def stage_predict_single(state):
+    row = state['X'].iloc[:1]
+    for _ in range(PREDICT_CALLS):
+        state['boosting'].predict(row)
+
+
+def stage_predict_batch(state):
+    state['boosting'].predict(state['X'])
+
+
+def stage_fit_scaler(state):
+    state['scaler'] = StandardScaler().fit(state['X'])
+
+
+def stage_fit_forest(state):
+    forest = grow_forest(make_forest(FOREST_PRESET), state['scaler'].transform(state['X']), state['y'],
+                         FOREST_PRESET)
+    state['forest'] = make_pipeline(state['scaler'], forest)
+
+
+def stage_predict_single_forest(state):
+    row = state['X'].iloc[:1]
+    for _ in range(PREDICT_CALLS):
+        state['forest'].predict(row)
+
+
+def stage_predict_batch_forest(state):
+    state['forest'].predict(state['X'])
+
+
+STAGES = {
+    'load_csv': stage_load_csv,
+    'prepare_merge': stage_prepare_merge,
+    'compact': stage_compact,
+    'aggregates': stage_aggregates,
+    'encode': stage_encode,
+    'fit_linear': stage_fit_linear,
+    'fit_boosting': stage_fit_boosting,
+    'predict_single': stage_predict_single,
+    'predict_batch': stage_predict_batch,
+    'fit_scaler': stage_fit_scaler,
+    'fit_forest': stage_fit_forest,
+    'predict_single_forest': stage_predict_single_forest,
+    'predict_batch_forest': stage_predict_batch_forest,
+}
+
+
+def measure(stage, state, repeat):
+    "(median seconds, peak traced MB) of a stage"
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stage(state)
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    stage(state)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak / 2**20
+
+
+def run_suite(directory, repeat, stages = STAGES):
+    "Results of every stage on one data directory (stages run in order, sharing their outputs)"
+    state = {'directory': directory}
+    results = []
+    for name, stage in stages.items():
+        seconds, peak_mb = measure(stage, state, repeat)
+        results.append({'stage': name, 'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 1)})
+    return [{**result, 'rows': len(state['merged'])} for result in results]
+
+
+def git_commit():
+    "Current commit of the repository, or None"
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = ROOT, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    "Print the time and memory ratios against a previous report"
+    before = {(r['dataset'], r['stage']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline.get('commit')}:")
+    print(f"{'Dataset':<16}{'Stage':<24}{'time ratio':>12}{'memory ratio':>14}")
+    for result in results:
+        old = before.get((result['dataset'], result['stage']))
+        if old is None:
+            continue
+        time_ratio = result['seconds'] / old['seconds'] if old['seconds'] else float('nan')
+        memory_ratio = result['peak_mb'] / old['peak_mb'] if old['peak_mb'] else float('nan')
+        print(f"{result['dataset']:<16}{result['stage']:<24}{time_ratio:>12.2f}{memory_ratio:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmark the data and modeling pipeline.")
+    parser.add_argument('--scales', type = int, nargs = '+', default = [1, 10],
+                        help = "dataset sizes, as multiples of the shipped stores (e.g. 1 10 100)")
+    parser.add_argument('--repeat', type = int, default = 3, help = "timed runs per stage")
+    parser.add_argument('--forest-max-scale', type = int, default = 1,
+                        help = "largest scale the Random Forest stages run at")
+    parser.add_argument('--output', help = "write the results to this JSON file")
+    parser.add_argument('--compare', help = "JSON results of a previous run to compare with")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix = 'benchmark-') as tmp:
+        for scale in args.scales:
+            name, directory = dataset(scale, tmp)
+            stages = {name: stage for name, stage in STAGES.items()
+                      if name not in FOREST_STAGES or scale <= args.forest_max_scale}
+            for result in run_suite(directory, args.repeat, stages):
+                results.append({'dataset': name, **result})
+                print(f"{name:<16}{result['stage']:<24}{result['seconds']:>10.3f}s{result['peak_mb']:>10.1f} MB")
+
+    report = {'commit': git_commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': args.repeat, 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent = 2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,10 @@ Page : Data Exploration
 import streamlit as st
 import pandas as pd
 
+from utils.loader import SALES_PATH, FEATURES_PATH, STORES_PATH, load_stores, load_sales, load_features
+from utils.quality import load_profile
+from utils.instrument import stage
+
 def exploration():
     "Data Exploration content page"
     st.title("Data Exploration")
@@ -12,15 +16,15 @@ def exploration():
 
     with st.spinner('Loading Data...⏳'):
         try:
-            # Reading .csv files
-            df = pd.read_csv('data/merged_retail_data.csv')
-            stores = pd.read_csv('data/stores.csv')
-            sales = pd.read_csv('data/sales.csv')
-            features = pd.read_csv('data/features.csv')
+            # Reading .csv files (parsed once per file version, shared across reruns)
+            stores = load_stores()
+            sales = load_sales()
+            features = load_features()
 
-            # Calculating the percentage of missing values in a dataframe
-            nan_info = {name: (data.isna().sum(), (data.isna().mean() * 100).round(2)) 
-                        for name, data in zip(['Sales', 'Stores', 'Features', 'Merged Data'], [sales, stores, features, df])}
+            # Data-quality profiles (one pass per table, computed once per file version)
+            with stage('profile'):
+                profiles = {name: load_profile(path, data) for name, path, data in
+                            [('stores', STORES_PATH, stores), ('features', FEATURES_PATH, features), ('sales', SALES_PATH, sales)]}
 
         except pd.errors.EmptyDataError as e:
             st.error(f"An error occurred while reading the CSV file: {str(e)}")
@@ -44,10 +48,10 @@ def exploration():
     st.write("### Overview of stores.csv")
     st.write("**Description:** Anonymized information about the 45 stores, indicating the type and size of store.")
     st.dataframe(stores.head())
-    st.metric(label = "Number of rows", value = stores.shape[0])
-    st.metric(label = "Number of columns", value = stores.shape[1])
-    st.write("Missing values per column:")
-    st.write(stores.isna().sum())
+    st.metric(label = "Number of rows", value = profiles['stores']['rows'])
+    st.metric(label = "Number of columns", value = profiles['stores']['columns'])
+    st.write(f"Missing values, range and distinct values per column ({profiles['stores']['duplicates']} duplicated rows):")
+    st.dataframe(profiles['stores']['table'])
     st.write("---")
 
     # Features dataset
@@ -64,10 +68,10 @@ def exploration():
     - **IsHoliday:** whether the week is a special holiday week
     """)
     st.dataframe(features.head())
-    st.metric(label = "Number of rows", value = features.shape[0])
-    st.metric(label = "Number of columns", value = features.shape[1])
-    st.write("Missing values per column:")
-    st.write(features.isna().sum())
+    st.metric(label = "Number of rows", value = profiles['features']['rows'])
+    st.metric(label = "Number of columns", value = profiles['features']['columns'])
+    st.write(f"Missing values, range and distinct values per column ({profiles['features']['duplicates']} duplicated rows):")
+    st.dataframe(profiles['features']['table'])
     st.write("---")
 
     # Sales dataset
@@ -81,7 +85,7 @@ def exploration():
     - **IsHoliday:** whether the week is a special holiday week
     """)
     st.dataframe(sales.head())
-    st.metric(label = "Number of rows", value = sales.shape[0])
-    st.metric(label = "Number of columns", value = sales.shape[1])
-    st.write("Missing values per column:")
-    st.write(sales.isna().sum())
\ No newline at end of file
+    st.metric(label = "Number of rows", value = profiles['sales']['rows'])
+    st.metric(label = "Number of columns", value = profiles['sales']['columns'])
+    st.write(f"Missing values, range and distinct values per column ({profiles['sales']['duplicates']} duplicated rows):")
+    st.dataframe(profiles['sales']['table'])
\ No newline at end of file
@@ -0,0 +1,61 @@
+"""
+Page : Store forecasts
+"""
+
+import streamlit as st
+import pandas as pd
+
+from utils.loader import load_merged
+from utils.forecast import HORIZON, load_forecasts
+from utils.instrument import stage
+
+def forecasting():
+    "Store forecasts content page"
+
+    st.title("Store and department forecasts")
+    st.info("One model per store and per department, reconciled so the departments add up to their store !", icon = "📈")
+
+    st.write("---")
+
+    # Forecasts (only the series whose data changed are trained again)
+    st.subheader("Forecasting")
+    horizon = st.slider("Weeks to forecast", min_value = 1, max_value = 26, value = HORIZON)
+    try:
+        with st.spinner('Forecasting...⏳'):
+            with stage('forecast'):
+                report = load_forecasts(horizon)
+            history = load_merged(columns = ['Store', 'Date', 'Weekly_Sales'])
+    except Exception as e:
+        st.error(f"An error occurred while forecasting: {str(e)}")
+        return
+    st.success(f"{report['fitted']} series trained, {report['reused']} reused from the cache ({report['seconds']:.1f}s)", icon = "✅")
+
+    st.write("""
+    **How the forecasts are made:**
+    - **Series**: the total sales of every store, and the sales of every department of every store, each get their own ridge regression on the trend, the sales of the same week one year earlier, the holiday calendar, the markdowns and the economic features.
+    - **Reconciliation**: store totals and department forecasts are adjusted together, so the department forecasts always add up to the store forecast.
+    - **Refresh**: every series model is cached with a hash of its training data; when the data changes, only the affected series are trained again, and changing the number of weeks only forecasts again.
+    """)
+
+    st.write("---")
+
+    # Store view
+    st.subheader("Forecasts by store")
+    stores = report['stores']
+    store = st.selectbox("Store", sorted(stores['Store'].unique()))
+
+    past = history[history['Store'] == store].groupby('Date')['Weekly_Sales'].sum().tail(52)
+    forecast = stores[stores['Store'] == store].set_index('Date')
+    chart = pd.DataFrame({'History': past, 'Forecast': forecast['Forecast']})
+    with stage('plot', rows = len(chart)):
+        st.line_chart(chart)
+
+    st.write("**Department forecasts:**")
+    departments = report['departments']
+    table = departments[departments['Store'] == store].pivot(index = 'Dept', columns = 'Date', values = 'Forecast')
+    table.columns = table.columns.strftime('%Y-%m-%d')
+    st.dataframe(table.round(2))
+
+    st.download_button("Download all department forecasts",
+                       data = departments.to_csv(index = False).encode(),
+                       file_name = "department_forecasts.csv")
@@ -7,9 +7,33 @@ import pandas as pd
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
+from sklearn.pipeline import make_pipeline
+from sklearn.impute import SimpleImputer
 import numpy as np
+import io
+
+from utils.loader import load_merged
+from utils.registry import get_registry, data_fingerprint, model_key
+from utils.training import MODEL_FEATURES, FOREST_PRESETS, make_forest, make_boosting
+from utils.batch import score_file, file_format
+from utils.encoding import STORE_TYPES, encode_columns
+from utils.features import TIME_FEATURES, LAGS, WINDOWS, load_feature_matrix, time_split
+from utils.backtest import FOLDS, HORIZON, load_backtest
+from utils.instrument import add_records, stage
+from utils.jobs import POLL_SECONDS, get_training_queue, jobs_per_worker
+from utils.incremental import ENGINES as INCREMENTAL_ENGINES, drift_check, read_manifest as read_checkpoints, update
+from utils.scenarios import (RANGE_INPUTS, STEPS, grid_rows, load_sweep, make_grid, response_curve,
+                             response_surface, surface_png)
+
+@st.fragment(run_every = POLL_SECONDS)
+def training_status(jobs, key):
+    "Progress of a background training job, refreshed until it is over (then the whole page reruns)"
+    job = jobs.status(key)
+    if job is None or job['state'] != 'running':
+        st.rerun()
+    if job['progress'] is not None:
+        st.progress(job['progress']['fraction'], text = job['progress']['message'])
+    st.caption(f"Training in the background for {job['seconds']:.0f}s: the other pages stay usable, and other users asking for the same model share this run.")
 
 def modelisation():
     "Modeling page content"
@@ -19,11 +43,19 @@ def modelisation():
 
     st.write("---")
 
+    # Feature set
+    feature_sets = ("Base features (random split)", "Time-aware features (chronological split)")
+    feature_set = st.radio("Feature set :", feature_sets, horizontal = True)
+    time_aware = feature_set == feature_sets[1]
+
     # Load the data
     st.subheader("Loading data")
     try:
-        data = pd.read_csv('data/merged_retail_data.csv')
-        st.success("merged_retail_data.csv successfully loaded!", icon = "✅")
+        if time_aware:
+            data = load_feature_matrix()
+        else:
+            data = load_merged(columns = MODEL_FEATURES + ['Weekly_Sales'])
+        st.success("merged_retail_data successfully loaded!", icon = "✅")
     except Exception as e:
         st.error(f"Failed to load data: {str(e)}")
         return
@@ -34,16 +66,28 @@ def modelisation():
     st.subheader("Data Preprocessing")
     
     # Explanation of Feature Selection
-    st.write("""
-    **Why some features were not chosen:**
-    - **Date**: The `Date` feature was not directly used in the model because it is a temporal feature that doesn't contribute directly to the prediction of sales. However, seasonal effects could be captured indirectly by features like `IsHoliday`, `Temperature`, and `Fuel_Price`.
-    - **MarkDown1-5**: These features represent promotional markdowns, but they were excluded as they are not always available and might introduce noise rather than improving the model's performance. In specific scenarios, however, these could be revisited for a different modeling approach focusing on promotional impacts.
-    """)
+    if time_aware:
+        st.write(f"""
+        **Time-aware features:**
+        - **Sales history**: sales of the same store and department {', '.join(map(str, LAGS))} weeks earlier, and the mean of its previous {' and '.join(map(str, WINDOWS))} weeks. Only past weeks are used, and a series without history yet gets missing values.
+        - **Calendar**: year, week of the year, and the number of weeks to the next holiday week and since the last one.
+        - **MarkDown1-5**: one flag per markdown (active or not) and the total markdown amount.
+        - **Chronological split**: the model is trained on the earliest 80% of the weeks and tested on the latest 20%, as it would be used to forecast.
+        """)
+    else:
+        st.write("""
+        **Why some features were not chosen:**
+        - **Date**: The `Date` feature was not directly used in the model because it is a temporal feature that doesn't contribute directly to the prediction of sales. However, seasonal effects could be captured indirectly by features like `IsHoliday`, `Temperature`, and `Fuel_Price`.
+        - **MarkDown1-5**: These features represent promotional markdowns, but they were excluded as they are not always available and might introduce noise rather than improving the model's performance. In specific scenarios, however, these could be revisited for a different modeling approach focusing on promotional impacts.
+        """)
     
     # Selecting relevant features and target variable
     st.write("**Selecting relevant features :**")
-    features = data[['Store', 'Dept', 'IsHoliday_x', 'Temperature', 'Fuel_Price', 'CPI', 'Unemployment', 'Type']]
+    feature_columns = TIME_FEATURES if time_aware else MODEL_FEATURES
+    features = data[feature_columns]
     target = data['Weekly_Sales']
+    with stage('fingerprint', rows = len(features)):
+        fingerprint = data_fingerprint(features, target)
     
     st.dataframe(features.head())
     
@@ -53,9 +97,16 @@ def modelisation():
     st.write("---")
 
     # Splitting the data into training and testing sets
-    st.info("**Splitting the data into training and testing sets (80% / 20%)**", icon = "🔧")
-    X_train, X_test, y_train, y_test = train_test_split(features, target, 
-                                                        test_size = 0.2, random_state = 42)
+    if time_aware:
+        st.info("**Splitting the data into training and testing sets (earliest 80% / latest 20% of the weeks)**", icon = "🔧")
+        with stage('split', rows = len(features)):
+            train, test = time_split(data['Date'])
+            X_train, X_test, y_train, y_test = features[train], features[test], target[train], target[test]
+    else:
+        st.info("**Splitting the data into training and testing sets (80% / 20%)**", icon = "🔧")
+        with stage('split', rows = len(features)):
+            X_train, X_test, y_train, y_test = train_test_split(features, target, 
+                                                                test_size = 0.2, random_state = 42)
     
     st.write(f"**Training set shape:** {X_train.shape}")
     st.write(f"**Testing set shape:** {X_test.shape}")
@@ -67,8 +118,9 @@ def modelisation():
 
     # Encoding categorical variables
     st.info("**Encoding categorical variables**", icon = "🔧")
-    X_train['Type'] = X_train['Type'].astype('category').cat.codes
-    X_test['Type'] = X_test['Type'].astype('category').cat.codes
+    with stage('encode', rows = len(features)):
+        X_train = encode_columns(X_train, feature_columns)
+        X_test = encode_columns(X_test, feature_columns)
     
     st.write("**Encoded training features sample:**")
     st.dataframe(X_train[:5])
@@ -77,12 +129,13 @@ def modelisation():
 
     # Applying feature scaling
     st.info("**Applying feature scaling to standardize the numerical features.**", icon = "🔧")
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_test_scaled = scaler.transform(X_test)
+    registry = get_registry()
+    with stage('fit_scaler', rows = len(X_train)):
+        scaler = registry.get_or_fit(model_key(X_train.columns, 'StandardScaler', {}, fingerprint),
+                                     lambda: StandardScaler().fit(X_train))
     
     st.write("**Scaled training features sample:**")
-    st.dataframe(pd.DataFrame(X_train_scaled, columns = X_train.columns).head())
+    st.dataframe(pd.DataFrame(scaler.transform(X_train[:5]), columns = X_train.columns))
     
     st.write("---")
 
@@ -90,36 +143,86 @@ def modelisation():
     st.subheader("Model Selection and Training")
     
     # Option to select model
-    model_choice = st.selectbox("Choose a model to train :", ("Linear Regression", "Random Forest Regressor"))
-    
-    if model_choice == "Linear Regression":
-        model = LinearRegression()
-    elif model_choice == "Random Forest Regressor":
-        model = RandomForestRegressor(n_estimators = 100, random_state = 42)
+    model_choices = ("Linear Regression", "Random Forest Regressor", "Histogram Gradient Boosting")
+    model_choice = st.selectbox("Choose a model to train :", model_choices)
     
-    # Model training
-    if model_choice == "Linear Regression":
-        st.info(f"Training the {model_choice} model...", icon = "🤖")
-    elif model_choice == "Random Forest Regressor":
-        st.info(f"Training the {model_choice} model... (~ 2 minutes)", icon = "🤖")
-    model.fit(X_train_scaled, y_train)
-    st.success(f"{model_choice} model trained successfully!", icon = "✅")
+    preset = list(FOREST_PRESETS)[0]
+    if model_choice == "Random Forest Regressor":
+        preset = st.radio("Random Forest preset :", list(FOREST_PRESETS), horizontal = True)
+        st.caption("Trees are grown in batches on the CPU cores (shared between concurrent trainings), and training stops early once the out-of-bag score stops improving.")
+    elif model_choice == "Histogram Gradient Boosting":
+        st.caption("Gradient boosting on binned features, with native handling of Store, Dept and Type as categories. It works on the unscaled features.")
+
+    def build_model(choice):
+        "Unfitted model and its registry key"
+        if choice == "Linear Regression" and time_aware:
+            # Missing history (NaN lags) becomes 0 once scaled, i.e. the column mean
+            model = make_pipeline(SimpleImputer(strategy = 'constant', fill_value = 0), LinearRegression())
+        elif choice == "Linear Regression":
+            model = LinearRegression()
+        elif choice == "Random Forest Regressor":
+            model = make_forest(preset)
+        else:
+            model = make_boosting(X_train)
+        params = model.get_params()
+        if choice == "Random Forest Regressor":
+            params['preset'] = preset
+        return model, model_key(X_train.columns, type(model).__name__, params, fingerprint)
+
+    # Model training (skipped when this exact model was already trained on this data)
+    model, key = build_model(model_choice)
+    with stage('load_model'):
+        entry = registry.get(key)
+    if entry is not None:
+        st.success(f"{model_choice} model loaded from the model registry!", icon = "✅")
+        if st.session_state.get('training_job') == key:
+            # First run since the job this session waited for: report its fit and predict stages
+            del st.session_state['training_job']
+            add_records(entry.get('stages', []))
+    else:
+        # Trained in a background process, shared with the other sessions asking for the same model
+        jobs = get_training_queue()
+        job = jobs.status(key)
+        if job is not None and job['state'] == 'failed':
+            st.error(f"An error occurred while training the model: {job['error']}")
+            if not st.button("Train again"):
+                return
+            job = None
+        if job is None:
+            with stage('submit'):
+                jobs.submit(key, model, scaler, X_train, y_train, X_test, y_test,
+                            preset = preset if model_choice == "Random Forest Regressor" else None,
+                            scaled = model_choice != "Histogram Gradient Boosting")
+        st.session_state['training_job'] = key
+        if model_choice == "Random Forest Regressor":
+            st.info(f"Training the {model_choice} model ({preset})...", icon = "🤖")
+        else:
+            st.info(f"Training the {model_choice} model...", icon = "🤖")
+        training_status(jobs, key)
+        return
+    pipeline = entry['pipeline']
+    metrics = entry['metrics']
 
     st.write("---")
 
     # Model Evaluation
     st.subheader("Model Evaluation")
     
-    # Predict on test set
-    y_pred = model.predict(X_test_scaled)
-    
-    # Calculate performance metrics
-    mse = mean_squared_error(y_test, y_pred)
-    rmse = np.sqrt(mse)
-    r2 = r2_score(y_test, y_pred)
-    
-    st.write(f"**R-squared (R²):** {r2:.2f}")
-    st.write(f"**Root Mean Squared Error (RMSE):** {rmse:.2f}")
+    st.write(f"**R-squared (R²):** {metrics['r2']:.2f}")
+    st.write(f"**Root Mean Squared Error (RMSE):** {metrics['rmse']:.2f}")
+
+    # Timing comparison with the other models trained on the same data
+    st.write("**Comparison with the other models (trained on the same data):**")
+    comparison = []
+    for choice in model_choices:
+        other = registry.metrics(build_model(choice)[1])
+        if other is None:
+            comparison.append({'Model': choice, 'Status': "Not trained yet"})
+        else:
+            comparison.append({'Model': choice, 'Status': "Trained", 'R²': round(other['r2'], 3),
+                               'RMSE': round(other['rmse'], 2), 'Fit time (s)': round(other['fit_seconds'], 2),
+                               'Predict time (µs/row)': round(other['predict_us_per_row'], 2)})
+    st.dataframe(pd.DataFrame(comparison).set_index('Model'))
     
     # Explanation of metrics
     st.info("""
@@ -131,12 +234,94 @@ def modelisation():
 
     st.write("---")
 
+    if time_aware:
+        # Walk-forward backtest
+        st.subheader("Walk-forward backtest")
+        st.write("Every engine is trained on the weeks before a forecast origin and tested on the weeks that follow, for several successive origins (folds run in parallel processes). WMAE weights holiday weeks 5 times more.")
+        with st.form("backtest"):
+            engines = st.multiselect("Engines :", model_choices, default = [model_choices[0], model_choices[2]])
+            folds = st.slider("Folds", min_value = 2, max_value = 8, value = FOLDS)
+            horizon = st.slider("Weeks per fold", min_value = 1, max_value = 13, value = HORIZON)
+            run = st.form_submit_button("Run backtest")
+        if run and engines:
+            try:
+                with st.spinner('Backtesting...⏳'), stage('backtest'):
+                    report = load_backtest(engines, folds, horizon)
+            except Exception as e:
+                st.error(f"An error occurred during the backtest: {str(e)}")
+            else:
+                st.write("**Per fold:**")
+                st.dataframe(report['folds'].round(3), hide_index = True)
+                st.write("**Mean over the folds:**")
+                st.dataframe(report['folds'].groupby('engine')[['rmse', 'mae', 'wmae', 'wall_seconds']].mean().round(3))
+                st.write("**Per store (all folds):**")
+                st.dataframe(report['stores'].round(3), hide_index = True)
+                st.caption(f"Total wall time: {report['wall_seconds']:.1f}s")
+
+        st.write("---")
+
+        st.info("Custom and batch predictions use the base feature set: switch the feature set above to use them (time-aware features need the sales history of each series).", icon = "💡")
+        return
+
+    # Incremental updates
+    st.subheader("Incremental updates")
+    st.write("When new weeks are appended to the data, these engines learn the new rows only instead of training again on the whole history: the linear model is updated by stochastic gradient descent (`partial_fit`), and the forest gets a few new trees grown on the new weeks. Every update is saved as a new checkpoint version, with the error of the previous version on the new weeks before they were learned. Check the drift before an update: the latest version and a full retrain on the same history are both scored on the new weeks.")
+    engine = st.selectbox("Incremental engine :", INCREMENTAL_ENGINES)
+    update_col, drift_col, rebase_col = st.columns(3)
+    clicked = {"update": update_col.button("Update with the new weeks"),
+               "drift": drift_col.button("Check drift against a full retrain"),
+               "rebase": rebase_col.button("Retrain from scratch")}
+    action = next((name for name, pressed in clicked.items() if pressed), None)
+
+    # Trained in the background process pool, like the models above (one update and one drift check per engine)
+    jobs = get_training_queue()
+    engine_key = engine.lower().replace(' ', '_')
+    job_keys = {"update": f"incremental_{engine_key}", "drift": f"drift_{engine_key}"}
+    if action is not None:
+        with stage('submit'):
+            if action == "drift":
+                jobs.run(job_keys["drift"], drift_check, engine, preset, n_jobs = jobs_per_worker(jobs.workers))
+            else:
+                jobs.run(job_keys["update"], update, engine, preset, rebase = action == "rebase",
+                         n_jobs = jobs_per_worker(jobs.workers))
+    for name, job_key in job_keys.items():
+        job = jobs.status(job_key)
+        if job is None:
+            continue
+        if job['state'] == 'running':
+            st.info("Updating the incremental model..." if name == "update" else "Checking the drift against a full retrain...", icon = "🤖")
+            training_status(jobs, job_key)
+        elif job['state'] == 'failed':
+            st.error(f"An error occurred during the incremental training: {job['error']}")
+        elif name == "update":
+            meta = job['result']
+            if meta is None:
+                st.success("The latest version is up to date: no new week since its last date.", icon = "✅")
+            else:
+                st.success(f"Version {meta['version']} trained up to {meta['last_date']} ({meta['rows']:,} rows, {meta['seconds']:.2f}s)", icon = "✅")
+        elif job['result'] is None:
+            st.info("The drift check scores the latest version on the weeks added after it: it needs an incremental update as the latest version, and new weeks it has not learned yet.", icon = "💡")
+        else:
+            report = job['result']
+            message = (f"On the {report['weeks']} weeks added after version {report['version']}, the incremental model's RMSE is {report['incremental_rmse']:,.2f} "
+                       f"against {report['full_rmse']:,.2f} for a full retrain on the same history (ratio {report['ratio']:.2f}).")
+            if report['drift']:
+                st.warning(message + " The incremental model has drifted: retrain it from scratch.", icon = "⚠️")
+            else:
+                st.success(message, icon = "✅")
+    versions = read_checkpoints(engine)
+    if versions:
+        st.write("**Checkpoint versions:**")
+        st.dataframe(pd.DataFrame(versions).set_index('version')[['kind', 'last_date', 'rows', 'seconds', 'rmse_before', 'created']].round(2))
+
+    st.write("---")
+
     # Predictions
     st.subheader("Make your own “Weekly_Sales” predictions !")
     
     # Input features for prediction
     st.write("Input the following features to predict the Weekly Sales:")
-    store = st.number_input("Store", min_value = 1, max_value = 45)
+    store = st.number_input("Store", min_value = 1, max_value = int(data['Store'].max()))
     dept = st.number_input("Department", min_value = 1)
     is_holiday = st.selectbox("Is Holiday?", [0, 1])
     temperature = st.number_input("Temperature")
@@ -150,11 +335,12 @@ def modelisation():
                                 fuel_price, cpi, unemployment, store_type]],
                                 columns = features.columns)
     
-    # Scale the input data
+    # Scale the input data (for display: the pipeline scales its own input when needed)
     input_data_scaled = scaler.transform(input_data)
 
     # Predict the sales
-    prediction = model.predict(input_data_scaled)
+    with stage('predict', rows = 1):
+        prediction = pipeline.predict(input_data)
     
     # Displaying user data & predicted sales
     st.write("**Selected user data:**")
@@ -162,3 +348,74 @@ def modelisation():
     st.write("**Scaled user data:**")
     st.dataframe(pd.DataFrame(input_data_scaled, columns = X_train.columns).head())
     st.success(f"**Predicted Weekly Sales:** ${prediction[0]:,.2f}", icon = "🤖")
+
+    st.write("---")
+
+    # What-if scenarios
+    st.subheader("What-if scenarios")
+    st.write("Sweep every combination of the values below (the Cartesian grid of the inputs) for the chosen stores and departments: the scenarios are scored in chunks with the model above, and the response curves show the mean predicted sales for every value of an input, over all the other scenarios.")
+    with st.form("scenarios"):
+        store_options = sorted(data['Store'].unique().tolist())
+        dept_options = sorted(data['Dept'].unique().tolist())
+        # The inputs above accept numbers absent from the data (e.g. gaps between departments)
+        stores = st.multiselect("Stores", store_options, default = [store] if store in store_options else store_options[:1])
+        depts = st.multiselect("Departments", dept_options, default = [dept] if dept in dept_options else dept_options[:1])
+        steps = st.slider("Values per input", min_value = 2, max_value = 50, value = STEPS)
+        values = {'Store': stores, 'Dept': depts}
+        for col in RANGE_INPUTS:
+            low, high = float(data[col].min()), float(data[col].max())
+            values[col] = np.linspace(*st.slider(col, min_value = low, max_value = high, value = (low, high)), steps)
+        values['IsHoliday_x'] = st.multiselect("Is Holiday?", [0, 1], default = [0, 1])
+        values['Type'] = st.multiselect("Store Type", [0, 1, 2], default = [0, 1, 2], format_func = lambda code: STORE_TYPES[code])
+        if st.form_submit_button("Run scenarios"):
+            try:
+                st.session_state['scenario_grid'] = (key, make_grid(values))
+            except ValueError as e:
+                st.error(f"Invalid scenarios: {str(e)}")
+
+    scenario = st.session_state.get('scenario_grid')
+    if scenario is not None and scenario[0] == key:
+        grid = scenario[1]
+        try:
+            with st.spinner('Scoring the scenarios...⏳'), stage('predict_scenarios', rows = grid_rows(grid)):
+                predictions = load_sweep(key, pipeline, grid)
+        except Exception as e:
+            st.error(f"An error occurred while scoring the scenarios: {str(e)}")
+        else:
+            st.success(f"{grid_rows(grid):,} scenarios scored!", icon = "🤖")
+            swept = [col for col, column_values in grid if len(column_values) > 1]
+            with stage('plot'):
+                for col in swept:
+                    st.write(f"**Response to {col}:**")
+                    curve = response_curve(predictions, grid, col)
+                    if col in RANGE_INPUTS:
+                        st.line_chart(curve)
+                    else:
+                        st.bar_chart(curve)
+            if len(swept) >= 2:
+                st.write("**Response surface:**")
+                x = st.selectbox("Horizontal axis", swept, index = 0)
+                y = st.selectbox("Vertical axis", [col for col in swept if col != x], index = 0)
+                with stage('plot'):
+                    st.image(surface_png(response_surface(predictions, grid, x, y)))
+
+    st.write("---")
+
+    # Batch predictions
+    st.subheader("Batch predictions")
+    st.write(f"Upload a CSV or Parquet file with the columns {', '.join(MODEL_FEATURES)} (`IsHoliday` and store types A/B/C are accepted too). Every row is scored with the model above, in chunks, and the results can be downloaded.")
+    uploaded = st.file_uploader("Feature rows to score", type = ['csv', 'parquet'])
+    if uploaded is not None:
+        fmt = file_format(uploaded.name)
+        output = io.BytesIO()
+        try:
+            with st.spinner('Scoring...⏳'), stage('predict_batch') as record:
+                rows = score_file(pipeline, uploaded, output, input_format = fmt, output_format = fmt)
+                record['rows'] = rows
+        except Exception as e:
+            st.error(f"An error occurred while scoring the file: {str(e)}")
+        else:
+            st.success(f"{rows:,} rows scored!", icon = "🤖")
+            name = uploaded.name.rsplit('.', 1)[0]
+            st.download_button("Download predictions", data = output.getvalue(),
+                               file_name = f"{name}_predictions.{fmt}")
@@ -5,6 +5,12 @@ Page : Data Processing
 import streamlit as st
 import pandas as pd
 
+from utils.loader import (FEATURES_PATH, SALES_PATH, STORES_PATH, load_features, load_sales, load_stores,
+                          load_merged, merged_source)
+from utils.pipeline import fill_missing_features, parse_dates, run_pipeline, read_manifest
+from utils.quality import load_profile, missing_values
+from utils.instrument import stage
+
 def preparation():
     "Data Processing content page"
     
@@ -15,9 +21,9 @@ def preparation():
     st.subheader("Loading data")
     
     try:
-        features = pd.read_csv('data/features.csv')
-        sales = pd.read_csv('data/sales.csv')
-        stores = pd.read_csv('data/stores.csv')
+        features = load_features()
+        sales = load_sales()
+        stores = load_stores()
         
         st.success("features.csv, sales.csv, stores.csv successfully loaded!", icon = "✅")
         
@@ -30,17 +36,14 @@ def preparation():
     # Missing Values Calculation
     st.subheader("Missing values")
 
-    def display_missing_values(df, name):
-        nan_count = df.isna().sum()
-        nan_percentage = (df.isna().mean() * 100).round(2)
-        nan_info = pd.concat([nan_count, nan_percentage], axis = 1, keys = ['NaN Count', '% of NaN'])
+    # Data-quality profiles (one pass per table, shared with the exploration page)
+    with stage('profile'):
+        profiles = {name: load_profile(path, data) for name, path, data in
+                    [('features', FEATURES_PATH, features), ('sales', SALES_PATH, sales), ('stores', STORES_PATH, stores)]}
+
+    for name, profile in profiles.items():
         st.write(f"**{name}.csv :**")
-        st.dataframe(nan_info[nan_info['NaN Count'] > 0])
-        return nan_info
-    
-    display_missing_values(features, "features")
-    display_missing_values(sales, "sales")
-    display_missing_values(stores, "stores")
+        st.dataframe(missing_values(profile))
     
     st.write("---")
     
@@ -53,24 +56,21 @@ def preparation():
       We use forward fill (ffill) to propagate the last known value forward to fill in missing entries, as these values typically change gradually over time.
     """)
     
-    # Fill missing values in MarkDown columns with 0
-    features[['MarkDown1', 'MarkDown2', 'MarkDown3', 'MarkDown4', 'MarkDown5']] = features[['MarkDown1', 'MarkDown2', 'MarkDown3', 'MarkDown4', 'MarkDown5']].fillna(0)
+    # Fill missing values in MarkDown columns with 0, and in CPI and Unemployment using ffill
+    features = fill_missing_features(features)
     st.success("Filled missing values in MarkDown columns with 0.", icon = "✅")
-    
-    # Fill missing values in CPI and Unemployment using ffill
-    features[['CPI', 'Unemployment']] = features[['CPI', 'Unemployment']].ffill()
     st.success("Filled missing values in CPI and Unemployment using forward fill.", icon = "✅")
     
     st.write("**Remaining missing values in Features :**")
-    st.dataframe(features.isnull().sum()[features.isnull().sum() > 0])
+    st.dataframe(missing_values(load_profile(FEATURES_PATH, features, stage = 'filled'))['NaN Count'])
     
     st.write("---")
     
     # Check for duplicates
     st.subheader("Checking duplicates")
-    st.write(f"**Number of duplicates in Features:** {features.duplicated().sum()}")
-    st.write(f"**Number of duplicates in Sales:** {sales.duplicated().sum()}")
-    st.write(f"**Number of duplicates in Stores:** {stores.duplicated().sum()}")
+    st.write(f"**Number of duplicates in Features:** {profiles['features']['duplicates']}")
+    st.write(f"**Number of duplicates in Sales:** {profiles['sales']['duplicates']}")
+    st.write(f"**Number of duplicates in Stores:** {profiles['stores']['duplicates']}")
     
     st.write("---")
     
@@ -79,8 +79,8 @@ def preparation():
     st.write("Converting the Date columns in Features and Sales datasets to datetime format.")
 
     try:
-        features['Date'] = pd.to_datetime(features['Date'], format='%d/%m/%Y')
-        sales['Date'] = pd.to_datetime(sales['Date'], format='%d/%m/%Y')
+        features = parse_dates(features)
+        sales = parse_dates(sales)
         st.success("Date columns successfully converted.", icon = "✅")
     except Exception as e:
         st.error(f"An error occurred while converting dates: {str(e)}")
@@ -90,11 +90,18 @@ def preparation():
     # Merge Datasets
     st.subheader("Merge datasets")
     st.write("Merging the Sales and Features datasets on Store and Date columns, and then merging the result with the Stores dataset on the Store column.")
+    st.write("Only the (Store, week) partitions whose input data changed since the last run are merged again; if nothing changed, the previous result is reused.")
+    st.write("Large sales histories are merged out of core: sales.csv is read in chunks, each chunk is joined to the features and stores tables through in-memory indexes on (Store, Date) and Store, and the merged rows are appended to the output files chunk by chunk.")
 
     try:
-        merged_data = pd.merge(sales, features, on=['Store', 'Date'], how='left')
-        merged_data = pd.merge(merged_data, stores, on='Store', how='left')
-        st.success("Datasets successfully merged!", icon = "✅")
+        report = run_pipeline()
+        if report['status'] == 'up-to-date':
+            st.success("Merged dataset is already up to date, nothing to merge!", icon = "✅")
+        else:
+            st.success(f"Datasets successfully merged! ({report['merged']} partitions merged, {report['removed']} removed)", icon = "✅")
+        merged_data = load_merged()
+        with stage('profile_merged'):
+            merged_profile = load_profile(merged_source(), merged_data)
         
         # Display merged data characteristics
         st.write("**Merged dataset characteristics:**")
@@ -102,25 +109,34 @@ def preparation():
 
         # Check for missing values in the merged dataset
         st.write("**Missing values in merged dataset :**")
-        st.dataframe(merged_data.isnull().sum()[merged_data.isnull().sum() > 0])
+        st.dataframe(missing_values(merged_profile)['NaN Count'])
         
         # Check for duplicates in the merged dataset
-        st.write(f"**Number of duplicates in merged dataset :** {merged_data.duplicated().sum()}")
+        st.write(f"**Number of duplicates in merged dataset :** {merged_profile['duplicates']}")
         
     except Exception as e:
         st.error(f"An error occurred while merging datasets: {str(e)}")
+        return
     
     st.write("---")
+
+    # Compact in-memory format
+    st.subheader("Compact data types")
+    st.write("To keep several sessions within the memory limits, the pages work on a compact copy of the merged dataset: Store and Dept are stored as small integers, Type and Size (repeated for every row of a store) as categories, the measures as float32, and `IsHoliday_y` is dropped after checking that it is identical to `IsHoliday_x`.")
+    manifest = read_manifest()
+    if manifest is not None:
+        memory = pd.DataFrame.from_dict(manifest['memory'], orient = 'index')
+        before, after = memory.loc['Total']
+        st.metric(label = "Memory of the merged dataset", value = f"{after / 1e6:,.1f} MB",
+                  delta = f"{(after - before) / 1e6:,.1f} MB ({after / before:.0%} of the original)", delta_color = "inverse")
+        st.dataframe(memory)
+
+    st.write("---")
     
     # Save the merged dataset
     st.subheader("Save the merged dataset")
-    st.write("Finally, we save the processed and merged dataset to a new CSV file.")
-
-    try:
-        merged_data.to_csv('data/merged_retail_data.csv', index=False)
-        st.success("Merged dataset saved successfully as 'merged_retail_data.csv'!", icon = "✅")
-    except Exception as e:
-        st.error(f"An error occurred while saving the merged dataset: {str(e)}")
+    st.write("Finally, the processed and merged dataset is saved to a CSV file, along with a typed and compressed Parquet copy that the other pages read. Files are written to a temporary file and then renamed, so other sessions never read a half-written dataset.")
+    st.success("Merged dataset saved as 'merged_retail_data.csv' and 'merged_retail_data.parquet'!", icon = "✅")
 
     st.write("---")
     
@@ -0,0 +1,135 @@
+"""
+Aggregate store : small precomputed tables for the Analysis and visualization page
+
+Every table is made of sums and counts, so when the pipeline replaces some (Store, week)
+partitions the tables are updated with the rows removed and added instead of being
+recomputed over the whole merged dataset. The correlation matrix is derived from
+additive moments (shifted sums of products) for the same reason.
+"""
+
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.encoding import encode_columns
+from utils.instrument import instrumented
+from utils.loader import DATA_DIR, MARKDOWNS, SHARED_VERSIONS, atomic_write, file_signature
+
+AGGREGATES_PATH = os.path.join(DATA_DIR, "merged_aggregates.joblib")
+AGGREGATES_VERSION = 1
+
+HIST_BIN_WIDTH = 500
+
+## Additive tables: name -> grouping columns
+GROUPINGS = {
+    'store_date': ['Store', 'Date'],
+    'dept': ['Dept'],
+    'type': ['Type'],
+    'holiday': ['IsHoliday_x'],
+    'histogram': ['Bin'],
+}
+
+## Columns of the correlation matrix (merged dataset order, categorical columns encoded)
+CORR_COLUMNS = ['Store', 'Dept', 'Date', 'Weekly_Sales', 'IsHoliday_x', 'Temperature', 'Fuel_Price',
+                *MARKDOWNS, 'CPI', 'Unemployment', 'IsHoliday_y', 'Type', 'Size']
+
+
+def _encode(rows):
+    "float64 matrix of the encoded CORR_COLUMNS (NaN where a row lacks its features or store)"
+    return encode_columns(rows, CORR_COLUMNS, missing = True).to_numpy(dtype = 'float64')
+
+
+def _sums(rows):
+    "Sum and count tables of a set of merged rows"
+    rows = rows.assign(Bin = np.floor(rows['Weekly_Sales'] / HIST_BIN_WIDTH).astype('int64'))
+    return {name: rows.groupby(keys, observed = True)['Weekly_Sales'].agg(['sum', 'count'])
+            for name, keys in GROUPINGS.items()}
+
+
+def _moments(rows, shift):
+    "Sums of products of [1, shifted encoded columns] over complete rows"
+    values = _encode(rows)
+    values = values[~np.isnan(values).any(axis = 1)] - shift
+    augmented = np.hstack([np.ones((len(values), 1)), values])
+    return augmented.T @ augmented
+
+
+def _correlation(moments):
+    "Pearson correlation matrix from moments"
+    n, sums, products = moments[0, 0], moments[0, 1:], moments[1:, 1:]
+    cov = (products - np.outer(sums, sums) / n) / (n - 1)
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        corr = cov / np.outer(std, std)
+    return pd.DataFrame(corr, index = CORR_COLUMNS, columns = CORR_COLUMNS)
+
+
+def _finish(sums, moments, shift, token):
+    "Aggregate store from additive parts, with the derived tables"
+    store_date = sums['store_date']
+    return {'version': AGGREGATES_VERSION, 'token': token, 'shift': shift,
+            'sums': sums, 'moments': moments,
+            'store': store_date.groupby(level = 'Store')['sum'].sum().rename('Weekly_Sales').reset_index(),
+            'date': store_date.groupby(level = 'Date')['sum'].sum().rename('Weekly_Sales'),
+            'corr': _correlation(moments)}
+
+
+def build_aggregates(merged_data, token = None):
+    "Aggregate store computed from the whole merged dataset"
+    # Shifting by the column means keeps the moments numerically stable (e.g. timestamps)
+    shift = np.nanmean(_encode(merged_data), axis = 0)
+    return _finish(_sums(merged_data), _moments(merged_data, shift), shift, token)
+
+
+def update_aggregates(aggregates, removed_rows, added_rows, token = None):
+    "Aggregate store after replacing `removed_rows` by `added_rows`"
+    removed, added = _sums(removed_rows), _sums(added_rows)
+    sums = {}
+    for name, table in aggregates['sums'].items():
+        table = table.add(added[name], fill_value = 0).sub(removed[name], fill_value = 0)
+        table = table[table['count'] > 0]
+        sums[name] = table.astype({'count': 'int64'})
+    shift = aggregates['shift']
+    moments = aggregates['moments'] - _moments(removed_rows, shift) + _moments(added_rows, shift)
+    return _finish(sums, moments, shift, token)
+
+
+def save_aggregates(aggregates):
+    "Atomically replace the aggregate store"
+    atomic_write(AGGREGATES_PATH, lambda tmp: joblib.dump(aggregates, tmp))
+
+
+def read_aggregates():
+    "Aggregate store on disk (uncached), or None"
+    try:
+        aggregates = joblib.load(AGGREGATES_PATH)
+    except FileNotFoundError:
+        return None
+    return aggregates if aggregates.get('version') == AGGREGATES_VERSION else None
+
+
+@st.cache_resource(show_spinner = False, max_entries = SHARED_VERSIONS)
+def _load_aggregates(path, signature):
+    return read_aggregates()
+
+
+@instrumented('load_aggregates')
+def load_aggregates():
+    "Aggregate store, read once per file version and shared read-only by all sessions"
+    aggregates = _load_aggregates(AGGREGATES_PATH, file_signature(AGGREGATES_PATH))
+    if aggregates is None:
+        raise FileNotFoundError(f"Outdated aggregate store: {AGGREGATES_PATH}")
+    return aggregates
+
+
+def histogram(aggregates, bins = 50):
+    "(counts, edges) of Weekly_Sales in about `bins` bins, from the precomputed fine bins"
+    fine = aggregates['sums']['histogram']['count']
+    lo, hi = fine.index.min(), fine.index.max() + 1
+    group = int(np.ceil((hi - lo) / bins))
+    counts = fine.groupby((fine.index - lo) // group).sum().reindex(range(bins), fill_value = 0)
+    edges = (lo + np.arange(bins + 1) * group) * HIST_BIN_WIDTH
+    return counts.to_numpy(), edges
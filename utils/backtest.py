@@ -0,0 +1,205 @@
+"""
+Walk-forward backtesting : rolling-origin, time-ordered folds scored in parallel
+
+Usage : python -m utils.backtest [--engine NAME ...] [--folds N] [--horizon WEEKS] [--workers N] [--output FILE]
+
+Fold i trains on every week before its origin and tests on the `horizon` weeks that
+follow; the origins of the folds are the last `folds * horizon` weeks of the history.
+Forecasts are one week ahead: the lag features of a test week may use the actual
+sales of the previous test weeks.
+
+The encoded feature matrix is written once to .npy files and memory-mapped by every
+worker process, so the folds share one copy of it instead of pickling it per task.
+Metrics are RMSE, MAE and WMAE (holiday weeks weighted 5, as in the Walmart
+competition), per fold and per store.
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from utils.encoding import encode_columns
+from utils.features import TIME_FEATURES, load_feature_matrix, week_numbers
+from utils.loader import file_signature, merged_source
+from utils.training import FOREST_PRESETS, make_boosting
+from utils.workers import process_pool
+
+FOLDS = 4
+HORIZON = 8
+HOLIDAY_WEIGHT = 5
+
+ENGINES = ("Linear Regression", "Random Forest Regressor", "Histogram Gradient Boosting")
+
+## Arrays shared with the workers (memory-mapped)
+ARRAYS = ['X', 'y', 'weeks', 'stores', 'weights']
+
+
+def make_engine(name, X):
+    "Unfitted model of an engine, for one process (the folds provide the parallelism)"
+    if name == "Linear Regression":
+        # Missing history (NaN lags) becomes 0 once scaled, i.e. the column mean
+        return make_pipeline(StandardScaler(), SimpleImputer(strategy = 'constant', fill_value = 0),
+                             LinearRegression())
+    if name == "Random Forest Regressor":
+        params = FOREST_PRESETS["Compact (float32, bounded depth)"]['params']
+        return RandomForestRegressor(n_estimators = 50, random_state = 42, n_jobs = 1, **params)
+    if name == "Histogram Gradient Boosting":
+        return make_boosting(X)
+    raise ValueError(f"Unknown engine: {name}")
+
+
+def make_folds(weeks, folds = FOLDS, horizon = HORIZON):
+    "(origin, end) week bounds of the test window of every fold, oldest first"
+    last = int(weeks.max()) + 1
+    origins = [last - horizon * (folds - i) for i in range(folds)]
+    if origins[0] <= 0:
+        raise ValueError(f"{folds} folds of {horizon} weeks need more than {last} weeks of history")
+    return [(origin, origin + horizon) for origin in origins]
+
+
+def errors(y_true, y_pred, weights, groups = None, size = None):
+    "Sums of squared, absolute and weighted absolute errors, with counts and weights (per group)"
+    error = y_pred - y_true
+    parts = {'sse': error ** 2, 'sae': np.abs(error), 'wae': weights * np.abs(error),
+             'n': np.ones_like(error), 'w': weights}
+    if groups is None:
+        return {name: float(values.sum()) for name, values in parts.items()}
+    return {name: np.bincount(groups, values, minlength = size) for name, values in parts.items()}
+
+
+def scores(sums):
+    "RMSE, MAE and WMAE from error sums (scalars or arrays)"
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return {'rmse': np.sqrt(sums['sse'] / sums['n']), 'mae': sums['sae'] / sums['n'],
+                'wmae': sums['wae'] / sums['w']}
+
+
+## Worker side
+
+_shared = {}
+
+
+def _attach(directory):
+    "Worker initializer: memory-map the shared arrays (read-only)"
+    for name in ARRAYS:
+        _shared[name] = np.load(os.path.join(directory, f"{name}.npy"), mmap_mode = 'r')
+
+
+def _run_fold(engine, feature_columns, origin, end):
+    "Fit `engine` on the weeks before `origin`, score it on [origin, end)"
+    start = time.perf_counter()
+    X, y, weeks = _shared['X'], _shared['y'], _shared['weeks']
+    train = np.flatnonzero(weeks < origin)
+    test = np.flatnonzero((weeks >= origin) & (weeks < end))
+    X_train = pd.DataFrame(X[train], columns = feature_columns)
+    model = make_engine(engine, X_train)
+    model.fit(X_train, y[train])
+    fit_seconds = time.perf_counter() - start
+
+    y_pred = model.predict(pd.DataFrame(X[test], columns = feature_columns))
+    y_test, weights, stores = y[test], _shared['weights'][test], _shared['stores'][test]
+    return {'origin': origin, 'end': end, 'train_rows': len(train), 'test_rows': len(test),
+            'errors': errors(y_test, y_pred, weights),
+            'store_errors': errors(y_test, y_pred, weights, stores, int(_shared['stores'].max()) + 1),
+            'fit_seconds': fit_seconds, 'wall_seconds': time.perf_counter() - start}
+
+
+## Driver side
+
+def share_arrays(matrix, feature_columns, directory):
+    "Write the encoded arrays of the feature matrix to `directory` as .npy files"
+    arrays = {'X': encode_columns(matrix, feature_columns).to_numpy(dtype = 'float32'),
+              'y': matrix['Weekly_Sales'].to_numpy(dtype = 'float64'),
+              'weeks': week_numbers(matrix['Date']),
+              'stores': matrix['Store'].to_numpy(dtype = 'int64'),
+              'weights': np.where(matrix['IsHoliday_x'].to_numpy(), HOLIDAY_WEIGHT, 1).astype('float64')}
+    for name, values in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), values)
+    return arrays['weeks']
+
+
+def run_backtest(matrix, engines = ENGINES, folds = FOLDS, horizon = HORIZON, workers = None,
+                 feature_columns = TIME_FEATURES):
+    """Walk-forward backtest of every engine on a feature matrix (see utils.features).
+
+    Folds run in a pool of `workers` processes (default: one per CPU, 1 runs them in
+    this process). Returns {'folds': per fold and engine, 'stores': per store and
+    engine, 'wall_seconds': total}.
+    """
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory(prefix = 'backtest-') as directory:
+        windows = make_folds(share_arrays(matrix, feature_columns, directory), folds, horizon)
+        labels = [(engine, fold) for engine in engines for fold in range(1, len(windows) + 1)]
+        tasks = [(engine, list(feature_columns), *windows[fold - 1]) for engine, fold in labels]
+        if workers == 1:
+            _attach(directory)
+            results = [_run_fold(*task) for task in tasks]
+            _shared.clear()
+        else:
+            with process_pool(min(workers, len(tasks)), initializer = _attach, initargs = (directory,)) as pool:
+                results = list(pool.map(_run_fold, *zip(*tasks)))
+
+    fold_rows, store_tables = [], []
+    for (engine, fold), result in zip(labels, results):
+        fold_rows.append({'engine': engine, 'fold': fold,
+                          'origin_week': result['origin'], 'end_week': result['end'],
+                          'train_rows': result['train_rows'], 'test_rows': result['test_rows'],
+                          **scores(result['errors']), 'fit_seconds': result['fit_seconds'],
+                          'wall_seconds': result['wall_seconds']})
+        store_tables.append(pd.DataFrame(result['store_errors']).assign(engine = engine)
+                            .rename_axis('Store').reset_index())
+
+    store_sums = pd.concat(store_tables).groupby(['engine', 'Store']).sum()
+    store_sums = store_sums[store_sums['n'] > 0]
+    stores = pd.DataFrame(scores(store_sums), index = store_sums.index).reset_index()
+    return {'folds': pd.DataFrame(fold_rows), 'stores': stores,
+            'wall_seconds': time.perf_counter() - start}
+
+
+@st.cache_data(show_spinner = False, max_entries = 16)
+def _cached_backtest(signature, engines, folds, horizon):
+    return run_backtest(load_feature_matrix(), engines, folds, horizon)
+
+
+def load_backtest(engines = ENGINES, folds = FOLDS, horizon = HORIZON):
+    "Backtest report of the merged dataset, computed once per data version and settings"
+    return _cached_backtest(file_signature(merged_source()), tuple(engines), folds, horizon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Walk-forward backtest of the forecasting engines.")
+    parser.add_argument('--engine', action = 'append', choices = ENGINES,
+                        help = "engine to evaluate (repeatable, default: all)")
+    parser.add_argument('--folds', type = int, default = FOLDS)
+    parser.add_argument('--horizon', type = int, default = HORIZON, help = "weeks per test window")
+    parser.add_argument('--workers', type = int, help = "worker processes (default: one per CPU)")
+    parser.add_argument('--output', help = "write the results to this JSON file")
+    args = parser.parse_args()
+
+    report = run_backtest(load_feature_matrix(), args.engine or ENGINES, args.folds, args.horizon, args.workers)
+    with pd.option_context('display.width', 160, 'display.max_columns', 20):
+        print(report['folds'].round(3).to_string(index = False))
+        print()
+        print(report['folds'].groupby('engine')[['rmse', 'mae', 'wmae', 'wall_seconds']].mean().round(3))
+    print(f"\nTotal wall time: {report['wall_seconds']:.1f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'folds': report['folds'].to_dict(orient = 'records'),
+                       'stores': report['stores'].to_dict(orient = 'records'),
+                       'wall_seconds': report['wall_seconds']}, f, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+Batch scoring : predict Weekly_Sales for a whole CSV/Parquet file of feature rows
+
+Usage : python -m utils.batch INPUT OUTPUT [--model KEY] [--chunk-size N]
+
+Rows are read, encoded and scored chunk by chunk, and every scored chunk is written
+out before the next one is read, so memory stays bounded whatever the file size.
+"""
+
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.encoding import encode_columns
+from utils.loader import atomic_write
+from utils.registry import ModelRegistry
+from utils.training import MODEL_FEATURES
+
+CHUNK_SIZE = 100_000
+PREDICTION_COLUMN = 'Predicted_Weekly_Sales'
+
+
+def file_format(name):
+    "'parquet' or 'csv', from a file name"
+    return 'parquet' if str(name).lower().endswith(('.parquet', '.pq')) else 'csv'
+
+
+def read_chunks(source, fmt, chunk_size = CHUNK_SIZE):
+    "Iterate over a CSV/Parquet path or file object, `chunk_size` rows at a time"
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(source).iter_batches(batch_size = chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize = chunk_size)
+
+
+def encode_features(chunk):
+    """Model input for a chunk of feature rows.
+
+    Accepts the raw sales naming (IsHoliday) and store types as letters (A/B/C) or codes.
+    """
+    chunk = chunk.rename(columns = {'IsHoliday': 'IsHoliday_x'})
+    missing = [col for col in MODEL_FEATURES if col not in chunk.columns]
+    if missing:
+        raise KeyError(f"Missing feature columns: {', '.join(missing)}")
+
+    return encode_columns(chunk, MODEL_FEATURES)
+
+
+def score_chunks(pipeline, chunks):
+    "Yield every chunk with its predictions appended"
+    for chunk in chunks:
+        chunk = chunk.copy()
+        chunk[PREDICTION_COLUMN] = pipeline.predict(encode_features(chunk))
+        yield chunk
+
+
+def write_chunks(chunks, target, fmt):
+    "Stream scored chunks to a path or binary file object; returns the number of rows"
+    rows = 0
+    if fmt == 'parquet':
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index = False)
+                if writer is None:
+                    writer = pq.ParquetWriter(target, table.schema, compression = 'snappy')
+                writer.write_table(table.cast(writer.schema))
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        for chunk in chunks:
+            chunk.to_csv(target, header = rows == 0, index = False, mode = 'a' if rows else 'w')
+            rows += len(chunk)
+    return rows
+
+
+def score_file(pipeline, source, target, input_format = None, output_format = None, chunk_size = CHUNK_SIZE):
+    """Score every row of `source` into `target` (paths or binary file objects).
+
+    Formats default to the file extensions. Returns the number of rows scored.
+    """
+    input_format = input_format or file_format(getattr(source, 'name', source))
+    output_format = output_format or file_format(getattr(target, 'name', target))
+    chunks = score_chunks(pipeline, read_chunks(source, input_format, chunk_size))
+    return write_chunks(chunks, target, output_format)
+
+
+def resolve_model(parser, key = None):
+    "(key, entry) of the registry model `key`, by default the latest trained on MODEL_FEATURES; exits otherwise"
+    try:
+        key, entry = ModelRegistry().resolve(key, MODEL_FEATURES)
+    except ValueError as e:
+        parser.error(str(e))
+    if entry is None:
+        parser.error("no model trained on the base features found: train one on the modeling page first")
+    return key, entry
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Predict Weekly_Sales for a CSV/Parquet file of feature rows.")
+    parser.add_argument('input', help = "CSV or Parquet file of feature rows")
+    parser.add_argument('output', help = "CSV or Parquet file to write (format from the extension)")
+    parser.add_argument('--model', help = "registry key of the model (default: most recently trained on the base features)")
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_SIZE, help = "rows scored per chunk")
+    args = parser.parse_args()
+
+    key, entry = resolve_model(parser, args.model)
+
+    scored = []
+    def write(tmp_path):
+        scored.append(score_file(entry['pipeline'], args.input, tmp_path,
+                                 output_format = file_format(args.output), chunk_size = args.chunk_size))
+    atomic_write(os.path.abspath(args.output), write)
+    print(f"{scored[0]} rows scored with model {key} -> {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+Feature encoding shared by the correlation aggregates and the models
+
+All conversions are vectorized and work column by column: encoding a frame builds
+a new frame from the requested columns only, without copying the others.
+"""
+
+import numpy as np
+import pandas as pd
+
+STORE_TYPES = ['A', 'B', 'C']
+
+
+def epoch_seconds(dates):
+    "Datetimes as int64 seconds since the epoch (through an int64 view, no per-element calls)"
+    return pd.to_datetime(dates).to_numpy().astype('datetime64[s]').view('int64')
+
+
+def type_codes(types, missing = False):
+    """Store types as int8 codes (A=0, B=1, C=2); already numeric codes are kept.
+
+    Raises ValueError on unknown or missing types (they would be scored as a code), or
+    with `missing`, returns float64 codes with NaN for them.
+    """
+    if pd.api.types.is_numeric_dtype(types):
+        values = types.to_numpy()
+        valid = np.isin(values, np.arange(len(STORE_TYPES)))
+    else:
+        values = pd.Categorical(types, categories = STORE_TYPES).codes
+        valid = values >= 0
+    if missing:
+        return np.where(valid, values, np.nan)
+    if not valid.all():
+        bad = pd.unique(np.asarray(types, dtype = object)[~valid])
+        raise ValueError(f"Unknown store Type: {', '.join(map(str, bad[:10]))} "
+                         f"(expected {', '.join(STORE_TYPES)} or codes 0-{len(STORE_TYPES) - 1})")
+    return values.astype('int8')
+
+
+def flags(values, missing = False):
+    "Booleans as int8 (0/1), or with `missing` as float64 with NaN for the missing ones"
+    if missing:
+        return values.astype('float64').to_numpy()
+    return values.to_numpy().astype('int8')
+
+
+def encode_columns(frame, columns, missing = False):
+    """Numeric frame of `columns`: Date as epoch seconds, Type as codes, holiday flags as int8.
+
+    Model inputs must be complete: missing or unknown types and flags raise. With `missing`
+    (statistics over merged rows, which may lack their features or store), they become NaN.
+    """
+    encoded = {}
+    for col in columns:
+        if col == 'Date':
+            encoded[col] = epoch_seconds(frame[col])
+        elif col == 'Type':
+            encoded[col] = type_codes(frame[col], missing)
+        elif col.startswith('IsHoliday'):
+            encoded[col] = flags(frame[col], missing)
+        elif isinstance(frame[col].dtype, pd.CategoricalDtype):
+            # e.g. Size in the compact schema: back to its numeric values
+            encoded[col] = frame[col].astype('float64' if missing else frame[col].cat.categories.dtype)
+        else:
+            encoded[col] = frame[col]
+    return pd.DataFrame(encoded, index = frame.index)
@@ -0,0 +1,134 @@
+"""
+Time-aware features : per-(Store, Dept) sales history, calendar and promotion features
+
+The features of a week only use the sales of earlier weeks of the same series, so the
+matrix can be split chronologically without leaking the future. Lags and rolling means
+are computed on sorted (series, week) keys with searchsorted and a cumulative sum,
+without any Python loop over rows or series: a missing week stays missing instead of
+shifting the history of its series.
+"""
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.encoding import epoch_seconds
+from utils.instrument import instrumented
+from utils.loader import MARKDOWNS, SHARED_VERSIONS, file_signature, load_merged, merged_source, view
+from utils.training import MODEL_FEATURES
+
+SERIES_KEYS = ['Store', 'Dept']
+LAGS = [1, 2, 52]
+WINDOWS = [4, 12]
+HOLIDAY_PERIOD = 52  # weeks: the holiday weeks of the dataset repeat every 52 weeks
+
+LAG_FEATURES = [f'Sales_Lag_{lag}' for lag in LAGS]
+ROLLING_FEATURES = [f'Sales_Mean_{window}' for window in WINDOWS]
+CALENDAR_FEATURES = ['Year', 'Week_Of_Year', 'Weeks_To_Holiday', 'Weeks_Since_Holiday']
+MARKDOWN_FEATURES = [f'Has_{col}' for col in MARKDOWNS] + ['MarkDown_Total']
+
+## Model input of the time-aware feature set
+TIME_FEATURES = (MODEL_FEATURES + ['Size'] + CALENDAR_FEATURES + MARKDOWN_FEATURES
+                 + LAG_FEATURES + ROLLING_FEATURES)
+
+
+def week_numbers(dates):
+    "Weeks elapsed since the first date (int64)"
+    days = epoch_seconds(dates) // 86400
+    return (days - days.min()) // 7
+
+
+def series_keys(data, weeks):
+    "Sortable int64 key per row: series number * span + week, with room for every lag and window"
+    span = int(weeks.max()) + 1 + max(LAGS + WINDOWS)
+    series = data.groupby(SERIES_KEYS, observed = True, sort = False).ngroup().to_numpy(dtype = 'int64')
+    return series * span + weeks
+
+
+def _lag(keys, sales, lag):
+    "Sales `lag` weeks earlier in the same series (NaN when that week is missing)"
+    pos = np.minimum(np.searchsorted(keys, keys - lag), len(keys) - 1)
+    return np.where(keys[pos] == keys - lag, sales[pos], np.nan)
+
+
+def _rolling_mean(keys, sales, window):
+    "Mean of the sales of the `window` previous weeks of the same series (current week excluded)"
+    known = ~np.isnan(sales)
+    sums = np.concatenate([[0.0], np.cumsum(np.where(known, sales, 0.0))])
+    counts = np.concatenate([[0], np.cumsum(known)])
+    # Keys of two series are more than `window` apart, so the bounds never cross series
+    hi = np.searchsorted(keys, keys)
+    lo = np.searchsorted(keys, keys - window)
+    count = counts[hi] - counts[lo]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        return np.where(count > 0, (sums[hi] - sums[lo]) / count, np.nan)
+
+
+def holiday_distances(weeks, holiday_weeks):
+    "(weeks to the next holiday week, weeks since the last one), 0 on a holiday week"
+    calendar = np.unique(np.concatenate([holiday_weeks - HOLIDAY_PERIOD, holiday_weeks,
+                                         holiday_weeks + HOLIDAY_PERIOD]))
+    following = np.searchsorted(calendar, weeks, side = 'left')
+    previous = np.searchsorted(calendar, weeks, side = 'right') - 1
+    padded = np.concatenate([calendar, [np.nan]]).astype('float64')
+    to_holiday = padded[following] - weeks
+    since_holiday = np.where(previous >= 0, weeks - padded[previous], np.nan)
+    return to_holiday, since_holiday
+
+
+def build_features(merged_data):
+    """Feature matrix of the merged dataset, aligned on its index.
+
+    Holds the TIME_FEATURES plus Date and Weekly_Sales (for splitting and scoring).
+    Lag and rolling features are NaN when the series has no history yet.
+    """
+    weeks = week_numbers(merged_data['Date'])
+    keys = series_keys(merged_data, weeks)
+    order = np.argsort(keys, kind = 'stable')
+    sorted_keys = keys[order]
+    sales = merged_data['Weekly_Sales'].to_numpy(dtype = 'float64')[order]
+
+    history = {}
+    for lag in LAGS:
+        history[f'Sales_Lag_{lag}'] = _lag(sorted_keys, sales, lag)
+    for window in WINDOWS:
+        history[f'Sales_Mean_{window}'] = _rolling_mean(sorted_keys, sales, window)
+
+    features = {col: merged_data[col] for col in MODEL_FEATURES + ['Size', 'Date', 'Weekly_Sales']}
+    features['Year'] = merged_data['Date'].dt.year.astype('int16')
+    features['Week_Of_Year'] = merged_data['Date'].dt.isocalendar().week.astype('int8')
+    to_holiday, since_holiday = holiday_distances(weeks, np.unique(weeks[merged_data['IsHoliday_x'].to_numpy()]))
+    features['Weeks_To_Holiday'] = to_holiday.astype('float32')
+    features['Weeks_Since_Holiday'] = since_holiday.astype('float32')
+
+    markdowns = merged_data[MARKDOWNS].fillna(0)
+    for col in MARKDOWNS:
+        features[f'Has_{col}'] = (markdowns[col] > 0).astype('int8')
+    features['MarkDown_Total'] = markdowns.sum(axis = 1).astype('float32')
+
+    for name, values in history.items():
+        # Back from the (series, week) order to the order of the merged rows
+        aligned = np.empty(len(values), dtype = 'float32')
+        aligned[order] = values
+        features[name] = aligned
+    return pd.DataFrame(features, index = merged_data.index)
+
+
+def time_split(dates, test_fraction = 0.2):
+    "(train mask, test mask): the last `test_fraction` of the weeks form the test set"
+    dates = np.asarray(dates)
+    weeks = np.unique(dates)
+    test = dates >= weeks[int(len(weeks) * (1 - test_fraction))]
+    return ~test, test
+
+
+@st.cache_resource(show_spinner = False, max_entries = SHARED_VERSIONS)
+def _feature_matrix(path, signature):
+    return build_features(load_merged())
+
+
+@instrumented('load_feature_matrix')
+def load_feature_matrix():
+    "Feature matrix of the merged dataset, built once per data version and shared by all sessions"
+    path = merged_source()
+    return view(_feature_matrix(path, file_signature(path)))
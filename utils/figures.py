@@ -0,0 +1,92 @@
+"""
+Figures of the Analysis and visualization page, rendered once per data version
+
+Each figure is built from the aggregate store and cached as PNG bytes, keyed on the
+aggregates token (the version of the merged dataset they describe). Figures are drawn
+on standalone matplotlib Figure objects, without the pyplot global state.
+"""
+
+import io
+
+import numpy as np
+import seaborn as sns
+import streamlit as st
+from matplotlib.figure import Figure
+
+from utils.aggregates import histogram
+
+
+def to_png(fig):
+    "PNG bytes of a figure"
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format = 'png', bbox_inches = 'tight')
+    return buffer.getvalue()
+
+
+@st.cache_data(show_spinner = False, max_entries = 8)
+def correlation_png(token, _aggregates):
+    "Annotated heatmap of the correlation matrix"
+    fig = Figure(figsize = (12, 12))
+    ax = fig.subplots()
+    sns.heatmap(_aggregates['corr'], annot = True, cmap = 'coolwarm', ax = ax)
+    ax.set_title('Correlation Matrix (Encoded Data)', fontsize = 18, pad = 20)
+    ax.tick_params(axis = 'x', labelrotation = 45, labelsize = 10)
+    ax.tick_params(axis = 'y', labelsize = 10)
+    for label in ax.get_xticklabels():
+        label.set_horizontalalignment('right')
+    cbar = ax.collections[0].colorbar
+    cbar.set_label('Correlation Coefficient', fontsize = 10, labelpad = 10)
+    cbar.ax.tick_params(labelsize = 8)
+    sns.despine(fig = fig)
+    return to_png(fig)
+
+
+@st.cache_data(show_spinner = False, max_entries = 8)
+def distribution_png(token, _aggregates):
+    "Weekly sales histogram, from the precomputed bin counts"
+    fig = Figure(figsize = (10, 6))
+    ax = fig.subplots()
+    counts, edges = histogram(_aggregates, bins = 50)
+    ax.bar(edges[:-1], counts, width = np.diff(edges), align = 'edge', edgecolor = 'k', alpha = 0.7)
+    ax.set_title('Weekly Sales Distribution')
+    ax.set_xlabel('Weekly Sales')
+    ax.set_ylabel('Frequency')
+    ax.grid(True, linestyle = '--')
+    return to_png(fig)
+
+
+@st.cache_data(show_spinner = False, max_entries = 8)
+def store_sales_png(token, _aggregates):
+    "Total sales by store, unsorted and in descending order"
+    store_sales = _aggregates['store']
+    sorted_store_sales = store_sales.sort_values(by = 'Weekly_Sales', ascending = False)
+
+    fig = Figure(figsize = (14, 16))
+    axes = fig.subplots(2, 1)
+    sns.barplot(ax = axes[0], x = 'Store', y = 'Weekly_Sales', data = store_sales,
+                palette = 'rainbow', hue = 'Store', legend = False)
+    axes[0].set_title('Total Sales by Store (Unsorted)', fontsize = 18)
+    axes[0].set_xlabel('Store')
+    axes[0].set_ylabel('Total Sales')
+
+    sns.barplot(ax = axes[1], x = 'Store', y = 'Weekly_Sales',
+                data = sorted_store_sales, palette = 'rainbow',
+                order = sorted_store_sales['Store'], hue = 'Store', legend = False)
+    axes[1].set_title('Total Sales by Store (Descending Order)', fontsize = 18)
+    axes[1].set_xlabel('Store')
+    axes[1].set_ylabel('Total Sales')
+    sns.despine(fig = fig)
+    fig.tight_layout()
+    return to_png(fig)
+
+
+@st.cache_data(show_spinner = False, max_entries = 8)
+def trend_png(token, _aggregates):
+    "Total sales per week"
+    fig = Figure(figsize = (12, 6))
+    ax = fig.subplots()
+    _aggregates['date'].plot(ax = ax)
+    ax.set_title('Sales Trend Over Time')
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Sales')
+    return to_png(fig)
@@ -0,0 +1,241 @@
+"""
+Hierarchical forecasting : one small model per store and per (store, department)
+
+Usage : python -m utils.forecast [--horizon WEEKS] [--workers N] [--output FILE]
+
+Every series (the total sales of a store, and the sales of each of its departments)
+gets its own ridge regression on trend, yearly seasonality (sales 52 weeks earlier),
+holiday proximity and the exogenous features, and forecasts the weeks of features.csv
+that follow the sales history. Series are fitted in a process pool, a chunk of series
+per task.
+
+The fitted models are cached per series along with a hash of the series' training
+rows, so a refresh only fits again the series whose history changed, and a different
+horizon only predicts again. Department forecasts are reconciled with the store
+totals (OLS reconciliation): they always add up to the store forecast.
+"""
+
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sklearn.impute import SimpleImputer
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from utils.features import build_features, week_numbers
+from utils.loader import (FEATURES_PATH, STORES_PATH, MARKDOWNS, atomic_write, file_signature,
+                          load_features, load_merged, load_stores, merged_source)
+from utils.pipeline import fill_missing_features, parse_dates
+from utils.registry import MODELS_DIR
+from utils.workers import process_pool
+
+FORECASTS_PATH = os.path.join(MODELS_DIR, "forecasts.joblib")
+FORECASTS_VERSION = 2
+
+HORIZON = 13
+CHUNK_SERIES = 64
+MIN_HISTORY = 12
+RIDGE_ALPHA = 1.0
+
+## Dept number of the store totals in the hierarchy
+TOTAL_DEPT = 0
+
+SERIES_KEYS = ['Store', 'Dept']
+SERIES_FEATURES = ['Trend', 'Sales_Lag_52', 'IsHoliday_x', 'Weeks_To_Holiday', 'Weeks_Since_Holiday',
+                   'Temperature', 'Fuel_Price', 'MarkDown_Total', 'CPI', 'Unemployment']
+
+## Merged columns the feature matrix is built from
+COLUMNS = ['Store', 'Dept', 'Date', 'Weekly_Sales', 'IsHoliday_x', 'Temperature', 'Fuel_Price',
+           *MARKDOWNS, 'CPI', 'Unemployment', 'Type', 'Size']
+
+
+## Hierarchy
+
+def future_rows(merged_data, features, stores, horizon = HORIZON):
+    "Rows to forecast: every (Store, Dept) series on the next `horizon` weeks of features.csv"
+    last = merged_data['Date'].max()
+    weeks = np.sort(features.loc[features['Date'] > last, 'Date'].unique())[:horizon]
+    if len(weeks) == 0:
+        raise ValueError(f"features.csv has no week after the last week of sales ({last:%Y-%m-%d}): "
+                         "nothing to forecast")
+    future = (features[features['Date'].isin(weeks)].rename(columns = {'IsHoliday': 'IsHoliday_x'})
+              .merge(stores, on = 'Store'))
+    series = merged_data[SERIES_KEYS].drop_duplicates()
+    return series.merge(future, on = 'Store').assign(Weekly_Sales = np.nan)[COLUMNS]
+
+
+def series_matrix(merged_data, future):
+    "Feature matrix of the department series and of the store totals (Dept = TOTAL_DEPT)"
+    departments = pd.concat([merged_data[COLUMNS], future], ignore_index = True)
+    by_week = departments.groupby(['Store', 'Date'], observed = True)
+    totals = by_week[[col for col in COLUMNS if col not in ['Store', 'Dept', 'Date', 'Weekly_Sales']]].first()
+    # min_count keeps the weeks to forecast missing instead of summing to 0
+    totals['Weekly_Sales'] = by_week['Weekly_Sales'].sum(min_count = 1)
+    totals = totals.reset_index().assign(Dept = TOTAL_DEPT)[COLUMNS]
+
+    matrix = build_features(pd.concat([totals, departments], ignore_index = True))
+    matrix['Trend'] = week_numbers(matrix['Date'])
+    return matrix
+
+
+def series_hashes(matrix, history):
+    "One hash per series, covering every training row (`history` mask) and feature its model depends on"
+    rows = matrix[history]
+    hashes = pd.util.hash_pandas_object(rows[SERIES_KEYS + ['Date', 'Weekly_Sales'] + SERIES_FEATURES],
+                                        index = False)
+    return hashes.groupby([rows['Store'], rows['Dept']]).sum()
+
+
+def reconcile(forecasts):
+    """Reconciled (departments, stores) forecasts from the base forecast of every series.
+
+    With one store total S over n department forecasts d, the OLS reconciliation moves
+    every department by (S - sum(d)) / (n + 1); the store forecast is the new sum.
+    """
+    base = forecasts.rename('Base').reset_index()
+    totals = base[base['Dept'] == TOTAL_DEPT].set_index(['Store', 'Date'])['Base']
+    departments = base[base['Dept'] != TOTAL_DEPT].copy()
+    by_week = departments.groupby(['Store', 'Date'])['Base']
+    store_base = totals.reindex(pd.MultiIndex.from_frame(departments[['Store', 'Date']])).to_numpy()
+    adjustment = (store_base - by_week.transform('sum').to_numpy()) / (by_week.transform('size').to_numpy() + 1)
+    departments['Forecast'] = departments['Base'] + np.nan_to_num(adjustment)
+
+    stores = departments.groupby(['Store', 'Date'], as_index = False)['Forecast'].sum()
+    stores['Base'] = totals.reindex(pd.MultiIndex.from_frame(stores[['Store', 'Date']])).to_numpy()
+    return departments, stores[['Store', 'Date', 'Base', 'Forecast']]
+
+
+## Series models (worker side)
+
+def fit_series(X, y):
+    """Model of one series: ridge regression, or the mean of a too short history.
+
+    Returned as the linear function it amounts to, (fill values of the missing
+    features, coefficients, intercept): small to cache, and applied by predict_series.
+    """
+    known = ~np.isnan(y)
+    if known.sum() < MIN_HISTORY:
+        return np.zeros(X.shape[1]), np.zeros(X.shape[1]), y[known].mean() if known.any() else 0.0
+    model = make_pipeline(SimpleImputer(strategy = 'mean', keep_empty_features = True),
+                          StandardScaler(), Ridge(alpha = RIDGE_ALPHA))
+    imputer, scaler, ridge = model.fit(X[known], y[known]).named_steps.values()
+    coef = ridge.coef_ / scaler.scale_
+    return np.nan_to_num(imputer.statistics_), coef, ridge.intercept_ - coef @ scaler.mean_
+
+
+def predict_series(model, X):
+    "Forecast of a series model (see fit_series) on the feature rows X"
+    fill, coef, intercept = model
+    return np.where(np.isnan(X), fill, X) @ coef + intercept
+
+
+def _fit_chunk(chunk):
+    return [(key, fit_series(*arrays)) for key, arrays in chunk]
+
+
+## Cache
+
+def read_forecasts(path = FORECASTS_PATH):
+    "Cached series models {(Store, Dept): {'hash', 'model'}}, empty when missing or outdated"
+    try:
+        cache = joblib.load(path)
+    except FileNotFoundError:
+        return {}
+    return cache['series'] if cache.get('version') == FORECASTS_VERSION else {}
+
+
+def save_forecasts(series, path = FORECASTS_PATH):
+    "Atomically replace the cached series models"
+    os.makedirs(os.path.dirname(path) or '.', exist_ok = True)
+    atomic_write(path, lambda tmp: joblib.dump({'version': FORECASTS_VERSION, 'series': series}, tmp))
+
+
+## Driver
+
+def run_forecasts(merged_data, features, stores, horizon = HORIZON, workers = None, path = FORECASTS_PATH):
+    """Reconciled forecasts of every store and department for the next `horizon` weeks.
+
+    Only the series whose training rows changed since the cached run are fitted, in a
+    pool of `workers` processes (default: one per CPU, 1 fits them in this process);
+    every series then forecasts the horizon. Returns {'departments', 'stores', 'fitted',
+    'reused', 'seconds'}.
+    """
+    start = time.perf_counter()
+    matrix = series_matrix(merged_data, future_rows(merged_data, features, stores, horizon))
+    future = (matrix['Date'] > merged_data['Date'].max()).to_numpy()
+    hashes = series_hashes(matrix, ~future)
+    cached = read_forecasts(path)
+    stale = {key for key, digest in hashes.items() if cached.get(key, {}).get('hash') != digest}
+
+    X = matrix[SERIES_FEATURES].to_numpy(dtype = 'float64')
+    y = matrix['Weekly_Sales'].to_numpy(dtype = 'float64')
+    dates = matrix['Date'].to_numpy()
+
+    payload, horizon_rows = [], {}
+    for key, rows in matrix.groupby(SERIES_KEYS, sort = True).indices.items():
+        key = tuple(int(k) for k in key)
+        horizon_rows[key] = rows[future[rows]]
+        if key in stale:
+            history = rows[~future[rows]]
+            payload.append((key, (X[history], y[history])))
+
+    chunks = [payload[i:i + CHUNK_SERIES] for i in range(0, len(payload), CHUNK_SERIES)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) <= 1:
+        results = map(_fit_chunk, chunks)
+    else:
+        with process_pool(min(workers, len(chunks))) as pool:
+            results = list(pool.map(_fit_chunk, chunks))
+
+    series = {key: cached[key] for key in hashes.index if key not in stale}
+    for chunk in results:
+        for key, model in chunk:
+            series[key] = {'hash': hashes[key], 'model': model}
+    save_forecasts(series, path)
+
+    forecasts = pd.concat({key: pd.Series(predict_series(series[key]['model'], X[rows]), index = dates[rows])
+                           for key, rows in horizon_rows.items()}, names = ['Store', 'Dept', 'Date'])
+    departments, stores_forecast = reconcile(forecasts)
+    return {'departments': departments, 'stores': stores_forecast, 'fitted': len(stale),
+            'reused': len(hashes) - len(stale), 'seconds': time.perf_counter() - start}
+
+
+def forecast_inputs():
+    "(merged, features, stores) as used by the forecasts, from the shared loaders"
+    return load_merged(), parse_dates(fill_missing_features(load_features())), load_stores()
+
+
+@st.cache_data(show_spinner = False, max_entries = 4)
+def _cached_forecasts(signatures, horizon):
+    return run_forecasts(*forecast_inputs(), horizon = horizon)
+
+
+def load_forecasts(horizon = HORIZON):
+    "Reconciled forecasts, refreshed once per version of the data files"
+    signatures = tuple(file_signature(path) for path in [merged_source(), FEATURES_PATH, STORES_PATH])
+    return _cached_forecasts(signatures, horizon)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Forecast every store and department (reconciled).")
+    parser.add_argument('--horizon', type = int, default = HORIZON, help = "weeks to forecast")
+    parser.add_argument('--workers', type = int, help = "worker processes (default: one per CPU)")
+    parser.add_argument('--output', help = "write the department forecasts to this CSV file")
+    args = parser.parse_args()
+
+    report = run_forecasts(*forecast_inputs(), horizon = args.horizon, workers = args.workers)
+    print(f"{report['fitted']} series fitted, {report['reused']} reused from the cache "
+          f"in {report['seconds']:.1f}s")
+    print(report['stores'].round({'Base': 2, 'Forecast': 2}).head(20).to_string(index = False))
+    if args.output:
+        report['departments'].to_csv(args.output, index = False)
+
+
+if __name__ == '__main__':
+    main()
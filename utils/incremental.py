@@ -0,0 +1,259 @@
+"""
+Incremental training : update models with the newly appended weeks only
+
+Usage : python -m utils.incremental [--engine NAME] [--until DATE] [--rebase] [--drift-check]
+
+Two engines can be updated without going back over the whole history:
+- "SGD Linear Regression": a linear model trained by stochastic gradient descent,
+  updated with partial_fit on the new rows;
+- "Incremental Random Forest": a warm-started forest to which every update adds a few
+  trees grown on the new rows (beyond MAX_TREES, the oldest update trees are dropped;
+  the trees grown on the whole history are kept).
+
+Updates only load the rows after the date of the latest checkpoint. Every update is
+saved as a new checkpoint version, along with the error of the previous version on
+the new weeks (scored before they are learned). Before an update, a drift check
+compares the latest version with a full retrain on the same history, on the new weeks
+neither has learned: when the incremental model is more than DRIFT_TOLERANCE worse, it
+should be rebased on a full retrain.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import SGDRegressor
+from sklearn.metrics import mean_squared_error
+from sklearn.preprocessing import StandardScaler
+
+from utils.encoding import encode_columns
+from utils.loader import atomic_write, load_merged
+from utils.registry import MODELS_DIR
+from utils.training import FOREST_PRESETS, MODEL_FEATURES, make_forest
+
+CHECKPOINTS_DIR = os.path.join(MODELS_DIR, "incremental")
+KEEP_VERSIONS = 10
+
+ENGINES = ("SGD Linear Regression", "Incremental Random Forest")
+
+EPOCHS = 5
+INITIAL_TREES = 50
+TREES_PER_UPDATE = 5
+MAX_TREES = 200
+DRIFT_TOLERANCE = 0.1
+
+
+## Engines
+
+class OnlineLinear:
+    "Linear regression trained by SGD on standardized features and target, updated with partial_fit"
+
+    def __init__(self, epochs = EPOCHS, random_state = 42):
+        self.epochs = epochs
+        self.random_state = random_state
+        self.scaler = StandardScaler()
+        self.model = SGDRegressor(alpha = 1e-4, learning_rate = 'invscaling', eta0 = 0.01,
+                                  random_state = random_state)
+
+    def partial_fit(self, X, y):
+        "Learn the rows of (X, y): `epochs` shuffled passes; the scaling is fixed by the first call"
+        X = np.asarray(X, dtype = 'float64')
+        y = np.asarray(y, dtype = 'float64')
+        if not hasattr(self, 'y_mean_'):
+            self.scaler.fit(X)
+            self.y_mean_, self.y_scale_ = y.mean(), y.std() or 1.0
+        X = self.scaler.transform(X)
+        y = (y - self.y_mean_) / self.y_scale_
+        rng = np.random.default_rng([self.random_state, len(y)])
+        for _ in range(self.epochs):
+            order = rng.permutation(len(y))
+            self.model.partial_fit(X[order], y[order])
+        return self
+
+    def predict(self, X):
+        return self.model.predict(self.scaler.transform(np.asarray(X, dtype = 'float64'))) * self.y_scale_ + self.y_mean_
+
+
+def make_incremental(engine, preset = None, n_jobs = -1):
+    "Unfitted incremental model (a forest grows its trees on `n_jobs` cores)"
+    if engine == "SGD Linear Regression":
+        return OnlineLinear()
+    forest = make_forest(preset or list(FOREST_PRESETS)[0], n_estimators = 0)
+    # Out-of-bag scores would only cover the rows of the last update
+    return forest.set_params(oob_score = False, n_jobs = n_jobs)
+
+
+def learn(engine, model, X, y, initial = False):
+    "Update `model` with the rows of (X, y); returns it"
+    if engine == "SGD Linear Regression":
+        return model.partial_fit(X, y)
+    grown = len(getattr(model, 'estimators_', []))
+    model.set_params(n_estimators = grown + (INITIAL_TREES if initial else TREES_PER_UPDATE))
+    # Trees work in float32 anyway (the feature names are kept)
+    model.fit(X.astype('float32'), np.asarray(y, dtype = 'float32'))
+    if len(model.estimators_) > MAX_TREES:
+        # Drop the oldest update trees: the first INITIAL_TREES, grown on the whole history, are kept
+        model.estimators_ = model.estimators_[:INITIAL_TREES] + model.estimators_[INITIAL_TREES - MAX_TREES:]
+        model.set_params(n_estimators = MAX_TREES)
+    return model
+
+
+def full_fit(engine, X, y, preset = None, n_jobs = -1):
+    "The same engine trained from scratch on all the rows of (X, y)"
+    return learn(engine, make_incremental(engine, preset, n_jobs), X, y, initial = True)
+
+
+def rmse(model, X, y):
+    "Root mean squared error of a model on (X, y)"
+    return float(np.sqrt(mean_squared_error(y, model.predict(X))))
+
+
+## Checkpoints
+
+def engine_dir(engine, directory = CHECKPOINTS_DIR):
+    "Checkpoint directory of an engine"
+    return os.path.join(directory, engine.lower().replace(' ', '_'))
+
+
+def read_manifest(engine, directory = CHECKPOINTS_DIR):
+    "Metadata of every checkpoint version of an engine, oldest first"
+    try:
+        with open(os.path.join(engine_dir(engine, directory), "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def _write_manifest(engine, versions, directory):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(versions, f, indent = 2)
+    atomic_write(os.path.join(engine_dir(engine, directory), "manifest.json"), write)
+
+
+def load_checkpoint(engine, version = None, directory = CHECKPOINTS_DIR):
+    "(model, metadata) of a checkpoint version (default: the latest), or (None, None)"
+    versions = read_manifest(engine, directory)
+    if version is not None:
+        versions = [meta for meta in versions if meta['version'] == version]
+    if not versions or versions[-1]['file'] is None:
+        return None, None
+    meta = versions[-1]
+    return joblib.load(os.path.join(engine_dir(engine, directory), meta['file'])), meta
+
+
+def save_checkpoint(engine, model, meta, directory = CHECKPOINTS_DIR):
+    "Save a new checkpoint version; the files of the oldest versions beyond KEEP_VERSIONS are removed"
+    folder = engine_dir(engine, directory)
+    os.makedirs(folder, exist_ok = True)
+    versions = read_manifest(engine, directory)
+    meta = {**meta, 'version': versions[-1]['version'] + 1 if versions else 1}
+    meta['file'] = f"v{meta['version']:04d}.joblib"
+    atomic_write(os.path.join(folder, meta['file']), lambda tmp: joblib.dump(model, tmp))
+    versions.append(meta)
+    for old in versions[:-KEEP_VERSIONS]:
+        if old['file'] is not None:
+            os.remove(os.path.join(folder, old['file']))
+            old['file'] = None
+    _write_manifest(engine, versions, directory)
+    return meta
+
+
+## Updates
+
+def training_data(since = None, until = None):
+    "(X, y, dates) of the merged weeks after the date `since` and up to the date `until`, in date order"
+    data = load_merged(columns = MODEL_FEATURES + ['Date', 'Weekly_Sales'])
+    # Selected on the shared frame first: only those rows are copied, sorted and encoded
+    if since is not None:
+        data = data[data['Date'] > pd.Timestamp(since)]
+    if until is not None:
+        data = data[data['Date'] <= pd.Timestamp(until)]
+    data = data.sort_values('Date', kind = 'stable')
+    return encode_columns(data, MODEL_FEATURES), data['Weekly_Sales'].to_numpy(), data['Date']
+
+
+def update(engine, preset = None, rebase = False, until = None, n_jobs = -1, directory = CHECKPOINTS_DIR):
+    """Learn the weeks after the latest checkpoint (up to the date `until`) and save the result as a new version.
+
+    Only the rows after the checkpoint's last date are loaded; the first run (or `rebase`)
+    trains on the whole history. A forest grows its trees on `n_jobs` cores. Returns the
+    metadata of the new version, or None when there is no new week.
+    """
+    model, latest = (None, None) if rebase else load_checkpoint(engine, directory = directory)
+    if model is None:
+        X, y, dates = training_data(until = until)
+        start = time.perf_counter()
+        model = full_fit(engine, X, y, preset, n_jobs)
+        meta = {'kind': 'full', 'rows': len(y), 'rmse_before': None}
+    else:
+        X, y, dates = training_data(since = latest['last_date'], until = until)
+        if not len(y):
+            return None
+        if engine != "SGD Linear Regression":
+            model.set_params(n_jobs = n_jobs)
+        start = time.perf_counter()
+        # Prequential error: the new weeks scored before they are learned
+        meta = {'kind': 'update', 'rows': len(y), 'rmse_before': rmse(model, X, y)}
+        model = learn(engine, model, X, y)
+    meta.update({'engine': engine, 'seconds': time.perf_counter() - start,
+                 'last_date': str(dates.max().date()), 'created': time.strftime('%Y-%m-%dT%H:%M:%S')})
+    return save_checkpoint(engine, model, meta, directory)
+
+
+def drift_check(engine, preset = None, until = None, n_jobs = -1, directory = CHECKPOINTS_DIR):
+    """Compare the latest checkpoint with a full retrain on the same history.
+
+    Both are scored on the weeks after the checkpoint's last date (up to the date `until`),
+    which neither has learned. Returns {'version', 'weeks', 'incremental_rmse', 'full_rmse',
+    'ratio', 'drift'}, or None when the latest checkpoint is a full retrain itself or when
+    there is no new week.
+    """
+    model, latest = load_checkpoint(engine, directory = directory)
+    if model is None or latest['kind'] == 'full':
+        return None
+    X, y, dates = training_data(until = until)
+    history = (dates <= pd.Timestamp(latest['last_date'])).to_numpy()
+    held_out = ~history
+    if not held_out.any():
+        return None
+    incremental = rmse(model, X[held_out], y[held_out])
+    full = rmse(full_fit(engine, X[history], y[history], preset, n_jobs), X[held_out], y[held_out])
+    ratio = incremental / full if full else float('nan')
+    return {'version': latest['version'], 'weeks': int(dates[held_out].nunique()), 'incremental_rmse': incremental,
+            'full_rmse': full, 'ratio': ratio, 'drift': bool(ratio > 1 + DRIFT_TOLERANCE)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Update incremental models with the new weeks of the merged data.")
+    parser.add_argument('--engine', choices = ENGINES, default = ENGINES[0])
+    parser.add_argument('--until', help = "only use the weeks up to this date (YYYY-MM-DD), e.g. to replay the history")
+    parser.add_argument('--rebase', action = 'store_true', help = "train from scratch on the whole history")
+    parser.add_argument('--drift-check', action = 'store_true',
+                        help = "before the update, compare the latest version with a full retrain on the new weeks")
+    args = parser.parse_args()
+
+    if args.drift_check:
+        report = drift_check(args.engine, until = args.until)
+        if report is None:
+            print("Drift check needs an incremental update as the latest version, and new weeks after it")
+        else:
+            print(f"Drift check of v{report['version']} on {report['weeks']} new weeks: incremental RMSE "
+                  f"{report['incremental_rmse']:.2f}, full retrain RMSE {report['full_rmse']:.2f} (ratio {report['ratio']:.2f})"
+                  + (": drift, rebase with --rebase" if report['drift'] else ""))
+    meta = update(args.engine, rebase = args.rebase, until = args.until)
+    if meta is None:
+        print(f"{args.engine} is up to date: no new week")
+    else:
+        print(f"{args.engine} v{meta['version']} ({meta['kind']}, {meta['rows']:,} rows, {meta['seconds']:.2f}s) "
+              f"trained up to {meta['last_date']}")
+
+
+if __name__ == '__main__':
+    # Through the package module: checkpoints must pickle OnlineLinear as utils.incremental's, not __main__'s
+    from utils.incremental import main
+    main()
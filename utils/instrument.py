@@ -0,0 +1,193 @@
+"""
+Instrumentation : wall time, peak memory and rows of the stages of a page run
+
+    with stage('profile') as record:
+        profile = profile_frame(data)
+        record['rows'] = len(data)
+
+or @instrumented('load_merged') on a function (rows taken from the length of its result).
+
+Every stage is logged as one JSON line on the 'retail.perf' logger (page, stage,
+seconds, peak RSS during the stage, rows) and kept for the current run, so that app.py can show the
+stages of the last rerun in a sidebar panel. The panel is hidden unless the app is
+opened with ?perf=1 (or RETAIL_PERF=1 is set); it can also profile a whole rerun with
+cProfile, or with pyinstrument when it is installed.
+"""
+
+import contextlib
+import cProfile
+import functools
+import io
+import json
+import logging
+import mmap
+import os
+import pstats
+import threading
+import time
+
+import streamlit as st
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+logger = logging.getLogger('retail.perf')
+
+PANEL_ENV = 'RETAIL_PERF'
+PANEL_PARAM = 'perf'
+PROFILE_LINES = 30
+
+## Interval between two resident memory samples during a stage
+RSS_SAMPLE_SECONDS = 0.01
+
+## Stages of the current run (Streamlit runs each session's script in its own thread)
+_run = threading.local()
+
+
+def setup_logging():
+    "Write the stage records to stderr, once per process"
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+
+def rss_mb():
+    "Current resident memory of the process (MB), or None without /proc (e.g. macOS, Windows)"
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * mmap.PAGESIZE / 2**20
+
+
+def sample_peak_rss(record, done):
+    "Keep the highest resident memory seen in record['peak_rss_mb'] until `done` is set"
+    while True:
+        rss = rss_mb()
+        if rss is None:
+            return
+        record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0, round(rss, 1))
+        if done.wait(RSS_SAMPLE_SECONDS):
+            break
+
+
+def rows_of(value):
+    "Number of rows of a table or array, or None"
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+def start_run(page):
+    "Start recording the stages of a run of `page`"
+    _run.page = page
+    _run.records = []
+
+
+def run_records():
+    "Stage records of the current run"
+    return list(getattr(_run, 'records', []))
+
+
+@contextlib.contextmanager
+def stage(name, rows = None):
+    """Time a stage and sample its peak resident memory; the yielded record's 'rows' can be set inside the block.
+
+    The memory is the whole process's (other sessions' threads included), sampled every
+    RSS_SAMPLE_SECONDS from the start to the end of the stage.
+    """
+    record = {'page': getattr(_run, 'page', None), 'stage': name, 'rows': rows, 'peak_rss_mb': None}
+    done = threading.Event()
+    sampler = threading.Thread(target = sample_peak_rss, args = (record, done), daemon = True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = round(time.perf_counter() - start, 4)
+        done.set()
+        sampler.join()
+        # One last sample: the end of a short stage may fall between two samples
+        sample_peak_rss(record, done)
+        if hasattr(_run, 'records'):
+            _run.records.append(record)
+        logger.info(json.dumps(record))
+
+
+def add_records(records):
+    "Add stage records measured elsewhere (e.g. by a training worker) to the current run"
+    for record in records:
+        record = {**record, 'page': getattr(_run, 'page', None)}
+        if hasattr(_run, 'records'):
+            _run.records.append(record)
+        logger.info(json.dumps(record))
+
+
+def instrumented(name):
+    "Decorator recording every call of a function as the stage `name`"
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                result = function(*args, **kwargs)
+                record['rows'] = rows_of(result)
+            return result
+        return wrapper
+    return decorate
+
+
+## Profiling
+
+def profilers():
+    "Profilers available in this environment"
+    return ['cProfile'] + (['pyinstrument'] if Profiler is not None else [])
+
+
+@contextlib.contextmanager
+def profiled(profiler = None):
+    "Profile the block with `profiler` (None: no profiling); the yielded dict gets its 'report' text"
+    output = {'report': None}
+    if profiler is None:
+        yield output
+    elif profiler == 'pyinstrument':
+        profile = Profiler()
+        profile.start()
+        try:
+            yield output
+        finally:
+            profile.stop()
+            output['report'] = profile.output_text(unicode = True)
+    else:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield output
+        finally:
+            profile.disable()
+            text = io.StringIO()
+            pstats.Stats(profile, stream = text).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            output['report'] = text.getvalue()
+
+
+## Panel
+
+def panel_enabled():
+    "Whether the performance panel is shown (?perf=1 in the URL, or RETAIL_PERF=1)"
+    return os.environ.get(PANEL_ENV, '') not in ('', '0') or st.query_params.get(PANEL_PARAM) not in (None, '', '0')
+
+
+def performance_panel(profile_report = None):
+    "Sidebar panel with the stages of the last run, and its profile"
+    with st.sidebar.expander("Performance", expanded = True):
+        records = run_records()
+        if records:
+            st.dataframe(records, column_order = ['stage', 'seconds', 'peak_rss_mb', 'rows'], hide_index = True)
+        else:
+            st.write("No instrumented stage in this run.")
+        if profile_report:
+            st.code(profile_report, language = None)
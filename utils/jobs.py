@@ -0,0 +1,180 @@
+"""
+Training jobs : models fitted in background processes, shared by every session
+
+Jobs are keyed on the model registry key, so identical requests (the same model,
+parameters and data, from any session) share one training run while it is in flight.
+A worker fits the model, scores it on the test set and saves the entry to the model
+registry directory; the page polls the job status and reads the model from the
+registry once it is done. The Random Forest progress is written to a small JSON file
+next to the model, so it can be shown while the job runs, and the fit and predict
+stages measured by the worker are saved with the model for the performance panel.
+Other long computations (e.g. incremental updates) run in the same pool with `run`,
+their result being kept in the job status.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import streamlit as st
+from sklearn.metrics import mean_squared_error, r2_score
+from sklearn.pipeline import make_pipeline
+
+from utils.instrument import run_records, stage, start_run
+from utils.loader import atomic_write
+from utils.registry import ModelRegistry, get_registry
+from utils.training import grow_forest
+from utils.workers import process_pool
+
+## Concurrent fits (the CPU cores are shared between them)
+TRAINING_WORKERS = 2
+POLL_SECONDS = 2
+
+
+## Worker side
+
+def write_progress(path, fraction, message):
+    "Atomically replace the progress file of a job"
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump({'fraction': fraction, 'message': message}, f)
+    atomic_write(path, write)
+
+
+def jobs_per_worker(workers = TRAINING_WORKERS):
+    "CPU cores each of `workers` concurrent jobs may use"
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def fit_and_score(directory, key, model, scaler, X_train, y_train, X_test, y_test, preset = None, scaled = True,
+                  n_jobs = None):
+    """Fit `model`, score it on the test set and save {'pipeline', 'features', 'metrics', 'stages'} to the registry.
+
+    A Random Forest (`preset` given) is grown in batches, reporting its progress; with
+    `scaled`, the model is fitted on scaled features and chained after `scaler`. `n_jobs`
+    caps the cores of models fitted in parallel. 'stages' are the instrument records of
+    the fit and of the test predictions. Returns the metrics.
+    """
+    registry = ModelRegistry(directory)
+    if n_jobs is not None and 'n_jobs' in model.get_params(deep = False):
+        model.set_params(n_jobs = n_jobs)
+    start_run('training')
+    with stage('fit', rows = len(X_train)):
+        start = time.perf_counter()
+        X_fit = scaler.transform(X_train) if scaled else X_train
+        if preset is not None:
+            progress_path = registry.progress_path(key)
+            grow_forest(model, X_fit, y_train, preset,
+                        callback = lambda fraction, message: write_progress(progress_path, fraction, message))
+        else:
+            model.fit(X_fit, y_train)
+        fit_seconds = time.perf_counter() - start
+
+    pipeline = make_pipeline(scaler, model) if scaled else model
+    with stage('predict_test', rows = len(X_test)):
+        start = time.perf_counter()
+        y_pred = pipeline.predict(X_test)
+        predict_seconds = time.perf_counter() - start
+    metrics = {'rmse': float(np.sqrt(mean_squared_error(y_test, y_pred))),
+               'r2': float(r2_score(y_test, y_pred)),
+               'fit_seconds': fit_seconds,
+               'predict_us_per_row': predict_seconds / len(X_test) * 1e6}
+    registry.put(key, {'pipeline': pipeline, 'features': list(X_train.columns), 'metrics': metrics,
+                       'stages': run_records()})
+    return metrics
+
+
+## Queue
+
+class TrainingQueue:
+    "Process pool running training jobs, with one job per key in flight"
+
+    def __init__(self, registry, workers = TRAINING_WORKERS):
+        self.registry = registry
+        self.workers = workers
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = process_pool(self.workers)
+        return self._pool
+
+    def submit(self, key, model, scaler, X_train, y_train, X_test, y_test, preset = None, scaled = True):
+        """Start training `key` (see fit_and_score) unless it is already in flight or saved.
+
+        Returns the job, or None when the model is already in the registry.
+        """
+        if self.registry.has(key):
+            return None
+        args = (self.registry.directory, key, model, scaler, X_train, y_train, X_test, y_test, preset, scaled,
+                jobs_per_worker(self.workers))
+        return self._start(key, fit_and_score, args, {}, keep = False)
+
+    def run(self, key, function, *args, **kwargs):
+        """Run function(*args, **kwargs) in a worker as the job `key`, unless it is already in flight.
+
+        The job stays listed once it is over, its status reporting the function's result
+        (or error) until it is run again. Returns the job.
+        """
+        return self._start(key, function, args, kwargs, keep = True)
+
+    def _start(self, key, function, args, kwargs, keep):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is not None and not job['future'].done():
+                return job
+            try:
+                future = self._executor().submit(function, *args, **kwargs)
+            except BrokenProcessPool:
+                # A worker died (e.g. out of memory): start a new pool
+                self._pool = None
+                future = self._executor().submit(function, *args, **kwargs)
+            job = {'future': future, 'started': time.time(), 'keep': keep}
+            self._jobs[key] = job
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return job
+
+    def _finished(self, key, future):
+        # Successful trainings are in the registry from now on; failed jobs stay to report their error
+        if future.exception() is None:
+            with self._lock:
+                job = self._jobs.get(key)
+                if job is not None and job['future'] is future and not job['keep']:
+                    del self._jobs[key]
+        try:
+            os.remove(self.registry.progress_path(key))
+        except FileNotFoundError:
+            pass
+
+    def status(self, key):
+        """Status of the job `key`: {'state': 'running' | 'failed' | 'done', 'seconds', 'progress', 'error', 'result'}
+
+        None when there is no such job: never submitted, or done and its model saved to the registry.
+        """
+        with self._lock:
+            job = self._jobs.get(key)
+        if job is None:
+            return None
+        future = job['future']
+        if future.done():
+            error = future.exception()
+            if error is None:
+                return {'state': 'done', 'result': future.result()}
+            return {'state': 'failed', 'error': str(error) or type(error).__name__}
+        try:
+            with open(self.registry.progress_path(key)) as f:
+                progress = json.load(f)
+        except (FileNotFoundError, ValueError):
+            progress = None
+        return {'state': 'running', 'seconds': time.time() - job['started'], 'progress': progress}
+
+
+@st.cache_resource
+def get_training_queue():
+    "Process-wide training queue, saving to the process-wide model registry"
+    return TrainingQueue(get_registry())
@@ -0,0 +1,195 @@
+"""
+Data loading layer shared by all pages
+
+Datasets are loaded once per process and file version into `st.cache_resource`, and
+shared read-only by every session: pages get lightweight views of the shared frames
+(copy-on-write), never private copies.
+"""
+
+import os
+import tempfile
+
+import streamlit as st
+import pandas as pd
+import pyarrow as pa
+
+from utils.instrument import instrumented
+from utils.schema import MARKDOWNS, compact, expand
+
+## Data files
+DATA_DIR = os.environ.get("RETAIL_DATA_DIR", "data")
+SALES_PATH = os.path.join(DATA_DIR, "sales.csv")
+FEATURES_PATH = os.path.join(DATA_DIR, "features.csv")
+STORES_PATH = os.path.join(DATA_DIR, "stores.csv")
+MERGED_PATH = os.path.join(DATA_DIR, "merged_retail_data.csv")
+MERGED_PARQUET_PATH = os.path.join(DATA_DIR, "merged_retail_data.parquet")
+MERGED_ARROW_PATH = os.path.join(DATA_DIR, "merged_retail_data.arrow")
+
+## Versions of the shared frames kept in memory per file (current + the one being replaced)
+SHARED_VERSIONS = 2
+
+## Views of the shared frames must never write through to them (default from pandas 3)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+## Explicit schemas, so every page shares the same parsed frame
+SALES_DTYPES = {'Store': 'int64', 'Dept': 'int64', 'Date': 'str',
+                'Weekly_Sales': 'float64', 'IsHoliday': 'bool'}
+
+FEATURES_DTYPES = {'Store': 'int64', 'Date': 'str', 'Temperature': 'float64',
+                   'Fuel_Price': 'float64', **{col: 'float64' for col in MARKDOWNS},
+                   'CPI': 'float64', 'Unemployment': 'float64', 'IsHoliday': 'bool'}
+
+STORES_DTYPES = {'Store': 'int64', 'Type': 'str', 'Size': 'int64'}
+
+MERGED_DTYPES = {'Store': 'int64', 'Dept': 'int64', 'Weekly_Sales': 'float64',
+                 'IsHoliday_x': 'bool', 'Temperature': 'float64', 'Fuel_Price': 'float64',
+                 **{col: 'float64' for col in MARKDOWNS}, 'CPI': 'float64',
+                 'Unemployment': 'float64', 'IsHoliday_y': 'bool', 'Type': 'str', 'Size': 'int64'}
+
+
+## Process umask, read once (os.umask can only be read by setting it)
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+
+def file_signature(path):
+    "Identify a file version by path, modification time and size"
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def view(frame, columns = None):
+    "Lightweight view of a shared frame (copy-on-write: the shared data is never modified)"
+    return frame[list(columns)] if columns is not None else frame.copy(deep = False)
+
+
+@st.cache_resource(show_spinner = False, max_entries = 3 * SHARED_VERSIONS)
+def _read_csv(path, signature, dtype):
+    "Parse a CSV once per file version (the signature is only part of the cache key)"
+    return pd.read_csv(path, dtype = dtype)
+
+
+@instrumented('load_sales')
+def load_sales():
+    "Raw sales.csv (view of the shared frame)"
+    return view(_read_csv(SALES_PATH, file_signature(SALES_PATH), SALES_DTYPES))
+
+
+@instrumented('load_features')
+def load_features():
+    "Raw features.csv (view of the shared frame)"
+    return view(_read_csv(FEATURES_PATH, file_signature(FEATURES_PATH), FEATURES_DTYPES))
+
+
+@instrumented('load_stores')
+def load_stores():
+    "Raw stores.csv (view of the shared frame)"
+    return view(_read_csv(STORES_PATH, file_signature(STORES_PATH), STORES_DTYPES))
+
+
+@st.cache_resource(show_spinner = False, max_entries = SHARED_VERSIONS)
+def _map_arrow(path, signature):
+    """Memory-map an uncompressed Arrow file as a read-only frame, once per file version.
+
+    Columns are zero-copy numpy views of the mapped pages, so the data lives once in
+    the OS page cache whatever the number of sessions.
+    """
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    return table.to_pandas(split_blocks = True)
+
+
+@st.cache_resource(show_spinner = False, max_entries = SHARED_VERSIONS)
+def _read_parquet(path, signature):
+    "Merged Parquet file in the compact schema, read once per file version"
+    # Parquet keeps Type as a dictionary but not Size: compact() restores it
+    return compact(pd.read_parquet(path))
+
+
+@st.cache_resource(show_spinner = False, max_entries = SHARED_VERSIONS)
+def _read_merged_csv(path, signature):
+    "Merged CSV in the compact schema, read once per file version"
+    return compact(pd.read_csv(path, dtype = MERGED_DTYPES, parse_dates = ['Date']))
+
+
+def atomic_write(path, write):
+    "Call `write(tmp_path)` on a temporary file next to `path`, then rename it over `path`"
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path) or '.', suffix = '.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        # mkstemp creates owner-only files: give the output the mode of a regular new file
+        os.chmod(tmp_path, 0o666 & ~UMASK)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_merged(merged_data):
+    """Write the merged dataset as CSV (human readable), Parquet (compact, portable) and
+    uncompressed Arrow (compact, memory-mapped by the pages).
+
+    All files are replaced atomically, so concurrent readers never see a partial file;
+    sessions still mapping the previous Arrow file keep reading it until they reload.
+    Returns the compact frame.
+    """
+    compacted = compact(merged_data)
+    atomic_write(MERGED_PATH, lambda tmp: merged_data.to_csv(tmp, index = False))
+    atomic_write(MERGED_PARQUET_PATH,
+                 lambda tmp: compacted.to_parquet(tmp, index = False, compression = 'snappy'))
+    atomic_write(MERGED_ARROW_PATH,
+                 lambda tmp: compacted.reset_index(drop = True).to_feather(tmp, compression = 'uncompressed'))
+    return compacted
+
+
+def append_merged(new_rows, rows, csv_bytes, sort_keys):
+    """Add merged rows to the dataset written by save_merged, without reading or rewriting its CSV.
+
+    `rows` and `csv_bytes` describe the dataset after its last complete write. The new
+    rows are appended to the CSV, cut first to `csv_bytes` (the rows of an interrupted
+    append are dropped), and the compact Parquet and Arrow files are written again from
+    the previous Arrow file and the new rows, sorted by `sort_keys`.
+
+    Returns (rows of the whole dataset, compact frame, CSV size), the whole dataset's
+    measures being the float32 compact values; None, without writing anything, when the
+    Arrow file does not have `rows` rows (an interrupted write: update from the CSV instead).
+    """
+    previous = pd.read_feather(MERGED_ARROW_PATH)
+    if len(previous) != rows or os.path.getsize(MERGED_PATH) < csv_bytes:
+        return None
+    with open(MERGED_PATH, 'r+b') as f:
+        f.truncate(csv_bytes)
+    with open(MERGED_PATH, 'a', newline = '') as f:
+        new_rows.to_csv(f, index = False, header = False)
+
+    merged_data = pd.concat([expand(previous), new_rows], ignore_index = True)[list(new_rows.columns)]
+    merged_data = merged_data.sort_values(sort_keys, kind = 'stable', ignore_index = True)
+    compacted = compact(merged_data)
+    atomic_write(MERGED_PARQUET_PATH,
+                 lambda tmp: compacted.to_parquet(tmp, index = False, compression = 'snappy'))
+    atomic_write(MERGED_ARROW_PATH,
+                 lambda tmp: compacted.to_feather(tmp, compression = 'uncompressed'))
+    return merged_data, compacted, os.path.getsize(MERGED_PATH)
+
+
+def merged_source():
+    "Path of the merged file the pages read: Arrow, else Parquet, else CSV"
+    for path in [MERGED_ARROW_PATH, MERGED_PARQUET_PATH]:
+        if os.path.exists(path):
+            return path
+    return MERGED_PATH
+
+
+@instrumented('load_merged')
+def load_merged(columns = None):
+    """Merged dataset written by the Data Processing page, in the compact schema.
+
+    Returns a view of the process-wide shared frame, memory-mapped from the Arrow file
+    when it exists (else read from Parquet, then CSV); `columns` restricts the view
+    to the columns a page actually needs.
+    """
+    path = merged_source()
+    read = {MERGED_ARROW_PATH: _map_arrow, MERGED_PARQUET_PATH: _read_parquet}.get(path, _read_merged_csv)
+    return view(read(path, file_signature(path)), columns)
@@ -0,0 +1,412 @@
+"""
+Headless preparation pipeline : clean, merge and save the retail datasets
+
+Usage : python -m utils.pipeline [--force] [--streaming] [--chunk-size ROWS]
+
+Content hashes of the inputs and of every (Store, week) partition are kept in a
+manifest next to the merged data. A rerun with unchanged inputs is a no-op (inputs
+whose size and modification time are unchanged are not even hashed), and when inputs
+change only the new or changed partitions are merged again. New partitions alone
+(e.g. a new week of sales) are appended to the merged CSV without reading it, which
+is then no longer sorted; the Parquet and Arrow files always are. The aggregate store
+used by the visualisation page is updated along the way.
+
+Large inputs are processed out of core: sales.csv and the previous merged CSV are read
+in chunks, the changed partitions are joined to the small features/stores tables through
+in-memory indexes, and the rows are spilled per store then written store by store, so
+memory stays bounded by the rows of one store whatever the size of the sales history.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.aggregates import AGGREGATES_PATH, build_aggregates, update_aggregates, read_aggregates, save_aggregates
+from utils.instrument import instrumented
+from utils.schema import compact, memory_report
+from utils.loader import (DATA_DIR, SALES_PATH, FEATURES_PATH, STORES_PATH, MERGED_PATH,
+                          MERGED_PARQUET_PATH, MERGED_ARROW_PATH, MARKDOWNS, SALES_DTYPES,
+                          FEATURES_DTYPES, STORES_DTYPES, MERGED_DTYPES, append_merged, atomic_write,
+                          file_signature, save_merged)
+
+MANIFEST_PATH = os.path.join(DATA_DIR, "merged_manifest.json")
+MANIFEST_VERSION = 2
+
+KEYS = ['Store', 'Date']
+SORT_KEYS = ['Store', 'Dept', 'Date']
+FILLED = ['CPI', 'Unemployment']
+
+## Streaming mode: rows per chunk, and sales.csv size from which rebuilds stream by default
+CHUNK_ROWS = 500_000
+STREAMING_THRESHOLD = 256 * 2**20
+
+
+## Preparation steps (shared with the Data Processing page)
+
+@instrumented('fill')
+def fill_missing_features(features):
+    "MarkDown NaNs mean no promotion (0); CPI and Unemployment are forward filled within each store"
+    features = features.copy()
+    features[MARKDOWNS] = features[MARKDOWNS].fillna(0)
+    features[FILLED] = features.groupby('Store')[FILLED].ffill()
+    return features
+
+
+@instrumented('parse_dates')
+def parse_dates(data):
+    "Convert the raw dd/mm/yyyy Date column to datetime"
+    data = data.copy()
+    data['Date'] = pd.to_datetime(data['Date'], format = '%d/%m/%Y')
+    return data
+
+
+@instrumented('merge')
+def merge_datasets(sales, features, stores):
+    "Sales + features on (Store, Date), then + stores on Store"
+    merged_data = pd.merge(sales, features, on = KEYS, how = 'left')
+    return pd.merge(merged_data, stores, on = 'Store', how = 'left')
+
+
+## Hashing
+
+def file_hash(path):
+    "SHA-256 of a file's content"
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sales_hashes(sales):
+    "Wrapping sum of the sales row hashes per (Store, week): chunks of sales.csv can be summed up"
+    return pd.util.hash_pandas_object(sales, index = False).groupby([sales['Store'], sales['Date']]).sum()
+
+
+def partition_hashes(sales, features, stores, sales_hash = None):
+    """One hash per (Store, week) partition, covering every input row that ends up in it.
+
+    Row hashes are combined with a wrapping sum, so the result does not depend on row order.
+    `sales_hash` replaces the sales table by its sales_hashes (e.g. summed over chunks).
+    """
+    if sales_hash is None:
+        sales_hash = sales_hashes(sales)
+    features_hash = pd.Series(pd.util.hash_pandas_object(features, index = False).to_numpy(),
+                              index = pd.MultiIndex.from_frame(features[KEYS]))
+    stores_hash = pd.Series(pd.util.hash_pandas_object(stores, index = False).to_numpy(),
+                            index = stores['Store'])
+
+    parts = pd.DataFrame({'sales': sales_hash})
+    parts['features'] = features_hash[~features_hash.index.duplicated()].reindex(
+        parts.index, fill_value = 0).to_numpy()
+    parts['stores'] = stores_hash.reindex(
+        parts.index.get_level_values('Store'), fill_value = 0).to_numpy()
+    return pd.util.hash_pandas_object(parts, index = True)
+
+
+def partitions_token(partitions):
+    "Hash of a whole set of partition hashes (identifies a version of the merged dataset)"
+    return hashlib.sha256(json.dumps(partitions, sort_keys = True).encode()).hexdigest()
+
+
+def partition_key(store, date):
+    "Manifest key of a (Store, week) partition"
+    return f"{store}|{date:%Y-%m-%d}"
+
+
+def partition_keys(frame):
+    "Manifest partition key of every row of a frame with Store and Date columns"
+    return frame['Store'].astype(str) + '|' + frame['Date'].dt.strftime('%Y-%m-%d')
+
+
+def partition_table(hashes):
+    "Manifest partitions {key: hex hash} from partition_hashes"
+    return {partition_key(store, date): format(h, '016x') for (store, date), h in hashes.items()}
+
+
+def sum_hashes(hashes):
+    "sales_hashes of the whole sales table from the sales_hashes of its chunks"
+    return pd.concat(hashes).groupby(level = [0, 1]).sum()
+
+
+## Manifest
+
+def read_manifest():
+    "Manifest of the last successful run, or None"
+    try:
+        with open(MANIFEST_PATH) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return manifest if manifest.get('version') == MANIFEST_VERSION else None
+
+
+def write_manifest(manifest):
+    "Atomically replace the manifest"
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+    atomic_write(MANIFEST_PATH, write)
+
+
+## Streaming mode
+
+def read_features_stream(path = FEATURES_PATH, chunk_size = CHUNK_ROWS):
+    """features.csv cleaned chunk by chunk, as fill_missing_features would on the whole file.
+
+    The last known CPI/Unemployment of every store is carried from one chunk to the next,
+    so the forward fill stays per store across chunk boundaries.
+    """
+    last = None
+    for chunk in pd.read_csv(path, dtype = FEATURES_DTYPES, chunksize = chunk_size):
+        chunk = fill_missing_features(chunk)
+        if last is not None:
+            chunk[FILLED] = chunk[FILLED].fillna(last.reindex(chunk['Store']).set_axis(chunk.index))
+        known = chunk.groupby('Store')[FILLED].last()
+        last = known if last is None else known.combine_first(last)
+        yield parse_dates(chunk)
+
+
+def broadcast_join(sales, features_index, stores_index):
+    "merge_datasets for a chunk of sales, through (Store, Date) and Store indexes of the small tables"
+    sales = sales.rename(columns = {'IsHoliday': 'IsHoliday_x'}).reset_index(drop = True)
+    features = features_index.reindex(pd.MultiIndex.from_frame(sales[KEYS])).reset_index(drop = True)
+    stores = stores_index.reindex(sales['Store']).reset_index(drop = True)
+    return pd.concat([sales, features, stores], axis = 1)
+
+
+def stream_dtypes(stores):
+    "Compact dtypes fixed from the stores table, so every streamed chunk has the same schema"
+    return {'Store': pd.to_numeric(stores['Store'], downcast = 'integer').dtype, 'Dept': 'int16',
+            'Type': pd.CategoricalDtype(sorted(stores['Type'].dropna().unique())),
+            'Size': pd.CategoricalDtype(sorted(stores['Size'].dropna().unique()))}
+
+
+def stream_pipeline(chunk_size = CHUNK_ROWS, previous = None):
+    """Bring every output up to date, reading the CSV files `chunk_size` rows at a time.
+
+    With the `previous` manifest partitions, the rows of the unchanged partitions are kept
+    from the previous merged CSV and only the new or changed partitions are merged again
+    (sales.csv is read twice: once to hash the partitions, once to merge them); without,
+    every partition is merged. Rows are spilled to temporary files per store, then written
+    store by store and sorted by SORT_KEYS like the in-memory pipeline, so memory is bounded
+    by the rows of one store. Returns (partitions, aggregates, rows, memory report, number
+    of partitions merged, number removed).
+    """
+    features = pd.concat(read_features_stream(FEATURES_PATH, chunk_size), ignore_index = True)
+    stores = pd.read_csv(STORES_PATH, dtype = STORES_DTYPES)
+    features_index = (features.rename(columns = {'IsHoliday': 'IsHoliday_y'})
+                      .drop_duplicates(KEYS).set_index(KEYS))
+    stores_index = stores.drop_duplicates('Store').set_index('Store')
+    dtypes = stream_dtypes(stores)
+
+    hashes, changed, stale, aggregates = [], None, set(), None
+    if previous is not None:
+        for sales in pd.read_csv(SALES_PATH, dtype = SALES_DTYPES, chunksize = chunk_size):
+            hashes.append(sales_hashes(parse_dates(sales)))
+        partitions = partition_table(partition_hashes(None, features, stores, sum_hashes(hashes)))
+        changed = {key for key, h in partitions.items() if previous.get(key) != h}
+        stale = changed | (previous.keys() - partitions.keys())
+        # The aggregates only take the delta if they match the previous merged dataset
+        aggregates = read_aggregates()
+        if aggregates is not None and aggregates['token'] != partitions_token(previous):
+            aggregates = None
+    rebuild_aggregates = aggregates is None
+    pieces = {}
+    state = {'holidays_differ': False, 'rows': 0, 'memory': None}
+
+    with tempfile.TemporaryDirectory(dir = DATA_DIR) as spill_dir:
+        def spill(merged_data):
+            "Append merged rows to the spill files of their stores"
+            if not merged_data['IsHoliday_x'].equals(merged_data['IsHoliday_y']):
+                state['holidays_differ'] = True
+            for store, rows in merged_data.groupby('Store', sort = False):
+                paths = pieces.setdefault(store, [])
+                paths.append(os.path.join(spill_dir, f"{store}-{len(paths)}.pkl"))
+                rows.to_pickle(paths[-1])
+
+        if previous is not None:
+            for existing in pd.read_csv(MERGED_PATH, dtype = MERGED_DTYPES, parse_dates = ['Date'],
+                                        chunksize = chunk_size):
+                stale_rows = partition_keys(existing).isin(stale)
+                if not rebuild_aggregates:
+                    aggregates = update_aggregates(aggregates, existing[stale_rows], existing.iloc[:0])
+                spill(existing[~stale_rows])
+
+        for sales in pd.read_csv(SALES_PATH, dtype = SALES_DTYPES, chunksize = chunk_size):
+            sales = parse_dates(sales)
+            if previous is None:
+                hashes.append(sales_hashes(sales))
+            else:
+                sales = sales[partition_keys(sales).isin(changed)]
+            if sales.empty:
+                continue
+            new_rows = broadcast_join(sales, features_index, stores_index)
+            if not rebuild_aggregates:
+                aggregates = update_aggregates(aggregates, new_rows.iloc[:0], new_rows)
+            spill(new_rows)
+        if not pieces:
+            raise ValueError(f"No sales rows in {SALES_PATH}")
+
+        def write(csv_path, parquet_path, arrow_path):
+            nonlocal aggregates
+            parquet_writer = arrow_writer = None
+            try:
+                for store in sorted(pieces):
+                    merged_data = pd.concat(map(pd.read_pickle, pieces[store]), ignore_index = True)
+                    merged_data = merged_data.sort_values(SORT_KEYS, kind = 'stable', ignore_index = True)
+                    compacted = compact(merged_data)
+                    if state['holidays_differ'] and 'IsHoliday_y' not in compacted.columns:
+                        # Dropped by compact() as identical for this store only
+                        compacted = compacted.assign(IsHoliday_y = compacted['IsHoliday_x'])[list(merged_data.columns)]
+                    table = pa.Table.from_pandas(compacted.astype(dtypes), preserve_index = False)
+                    if parquet_writer is None:
+                        parquet_writer = pq.ParquetWriter(parquet_path, table.schema, compression = 'snappy')
+                        arrow_writer = pa.ipc.new_file(arrow_path, table.schema)
+                    parquet_writer.write_table(table)
+                    arrow_writer.write_table(table)
+                    merged_data.to_csv(csv_path, index = False, header = state['rows'] == 0,
+                                       mode = 'a' if state['rows'] else 'w')
+
+                    if rebuild_aggregates:
+                        aggregates = (build_aggregates(merged_data) if aggregates is None
+                                      else update_aggregates(aggregates, merged_data.iloc[:0], merged_data))
+                    memory = memory_report(merged_data, compacted)
+                    state['memory'] = memory if state['memory'] is None else state['memory'].add(memory, fill_value = 0)
+                    state['rows'] += len(merged_data)
+            finally:
+                for writer in [parquet_writer, arrow_writer]:
+                    if writer is not None:
+                        writer.close()
+
+        # Nested atomic writes: the three files only replace the previous ones once all are complete
+        atomic_write(MERGED_PATH, lambda csv_path: atomic_write(
+            MERGED_PARQUET_PATH, lambda parquet_path: atomic_write(
+                MERGED_ARROW_PATH, lambda arrow_path: write(csv_path, parquet_path, arrow_path))))
+
+    if previous is None:
+        partitions = partition_table(partition_hashes(None, features, stores, sum_hashes(hashes)))
+        merged, removed = len(partitions), 0
+    else:
+        merged, removed = len(changed), len(stale) - len(changed)
+    aggregates['token'] = partitions_token(partitions)
+    return partitions, aggregates, state['rows'], state['memory'].astype('int64'), merged, removed
+
+
+## Pipeline
+
+@instrumented('load_inputs')
+def load_inputs():
+    "Raw input files, cleaned and with parsed dates"
+    sales = parse_dates(pd.read_csv(SALES_PATH, dtype = SALES_DTYPES))
+    features = parse_dates(fill_missing_features(pd.read_csv(FEATURES_PATH, dtype = FEATURES_DTYPES)))
+    stores = pd.read_csv(STORES_PATH, dtype = STORES_DTYPES)
+    return sales, features, stores
+
+
+@instrumented('run_pipeline')
+def run_pipeline(force = False, streaming = None, chunk_size = CHUNK_ROWS):
+    """Bring the merged dataset up to date with the input files.
+
+    With `streaming` (default: when sales.csv is larger than STREAMING_THRESHOLD),
+    outdated outputs are updated out of core, `chunk_size` rows at a time (see
+    stream_pipeline), instead of in memory.
+
+    Returns a report dict with the status ('up-to-date', 'rebuilt' or 'updated'),
+    the number of partitions merged and removed, and the number of output rows.
+    """
+    inputs = [('sales', SALES_PATH), ('features', FEATURES_PATH), ('stores', STORES_PATH)]
+    manifest = read_manifest()
+    outputs_exist = all(os.path.exists(path) for path in [MERGED_PATH, MERGED_PARQUET_PATH, MERGED_ARROW_PATH,
+                                                           AGGREGATES_PATH])
+    current = not force and outputs_exist and manifest is not None
+
+    # Unchanged sizes and modification times: the inputs are not even hashed
+    signatures = {name: list(file_signature(path)[1:]) for name, path in inputs}
+    if current and manifest.get('signatures') == signatures:
+        return {'status': 'up-to-date', 'merged': 0, 'removed': 0, 'rows': manifest['rows']}
+    input_hashes = {name: file_hash(path) for name, path in inputs}
+    if current and manifest['inputs'] == input_hashes:
+        write_manifest({**manifest, 'signatures': signatures})
+        return {'status': 'up-to-date', 'merged': 0, 'removed': 0, 'rows': manifest['rows']}
+
+    if streaming is None:
+        streaming = os.path.getsize(SALES_PATH) > STREAMING_THRESHOLD
+    rebuild = force or not outputs_exist or manifest is None
+    if streaming:
+        partitions, aggregates, rows, memory, merged, removed = stream_pipeline(
+            chunk_size, None if rebuild else manifest['partitions'])
+        save_aggregates(aggregates)
+        write_manifest({'version': MANIFEST_VERSION, 'inputs': input_hashes, 'signatures': signatures,
+                        'rows': rows, 'csv_bytes': os.path.getsize(MERGED_PATH), 'partitions': partitions,
+                        'memory': memory.to_dict(orient = 'index')})
+        return {'status': 'rebuilt' if rebuild else 'updated', 'merged': merged, 'removed': removed, 'rows': rows}
+
+    sales, features, stores = load_inputs()
+    partitions = partition_table(partition_hashes(sales, features, stores))
+    token = partitions_token(partitions)
+
+    appended = None
+    if rebuild:
+        merged_data = merge_datasets(sales, features, stores).sort_values(
+            SORT_KEYS, kind = 'stable', ignore_index = True)
+        aggregates = build_aggregates(merged_data, token)
+        status, merged, removed = 'rebuilt', len(partitions), 0
+    else:
+        previous = manifest['partitions']
+        changed = [key for key, h in partitions.items() if previous.get(key) != h]
+        stale = set(changed) | (previous.keys() - partitions.keys())
+        new_rows = merge_datasets(sales[partition_keys(sales).isin(changed)], features, stores)
+        status, merged, removed = 'updated', len(changed), len(stale) - len(changed)
+
+        # The aggregates only take the delta if they match the previous merged dataset
+        aggregates = read_aggregates()
+        if aggregates is None or aggregates['token'] != partitions_token(previous):
+            aggregates = None
+        elif not stale & previous.keys() and 'csv_bytes' in manifest:
+            # New partitions only (e.g. a new week): appended, the previous rows are not read again
+            appended = append_merged(new_rows.sort_values(SORT_KEYS, kind = 'stable', ignore_index = True),
+                                     manifest['rows'], manifest['csv_bytes'], SORT_KEYS)
+        if appended is None:
+            # Keep the untouched partitions of the previous output, merge only the changed ones
+            existing = pd.read_csv(MERGED_PATH, dtype = MERGED_DTYPES, parse_dates = ['Date'])
+            stale_rows = partition_keys(existing).isin(stale)
+            merged_data = pd.concat([existing[~stale_rows], new_rows], ignore_index = True)
+            merged_data = merged_data.sort_values(SORT_KEYS, kind = 'stable', ignore_index = True)
+            aggregates = (build_aggregates(merged_data, token) if aggregates is None
+                          else update_aggregates(aggregates, existing[stale_rows], new_rows, token))
+        else:
+            aggregates = update_aggregates(aggregates, new_rows.iloc[:0], new_rows, token)
+
+    # Outputs first, manifest last: an interrupted run is simply redone next time
+    if appended is None:
+        compacted = save_merged(merged_data)
+    else:
+        merged_data, compacted, _ = appended
+    save_aggregates(aggregates)
+    write_manifest({'version': MANIFEST_VERSION, 'inputs': input_hashes, 'signatures': signatures,
+                    'rows': len(merged_data), 'csv_bytes': os.path.getsize(MERGED_PATH), 'partitions': partitions,
+                    'memory': memory_report(merged_data, compacted).to_dict(orient = 'index')})
+    return {'status': status, 'merged': merged, 'removed': removed, 'rows': len(merged_data)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Clean, merge and save the retail datasets.")
+    parser.add_argument('--force', action = 'store_true', help = "rebuild every partition")
+    parser.add_argument('--streaming', action = 'store_true', default = None,
+                        help = "update out of core, reading the CSV files in chunks (default for large inputs)")
+    parser.add_argument('--chunk-size', type = int, default = CHUNK_ROWS, help = "sales rows per chunk")
+    args = parser.parse_args()
+    report = run_pipeline(force = args.force, streaming = args.streaming, chunk_size = args.chunk_size)
+    print(f"{report['status']}: {report['merged']} partitions merged, "
+          f"{report['removed']} removed, {report['rows']} rows")
+
+
+if __name__ == '__main__':
+    main()
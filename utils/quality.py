@@ -0,0 +1,60 @@
+"""
+Data-quality profile : null counts, duplicates, ranges and cardinality of a table
+
+Each column is factorized once: the codes give its null count, the (small) array of
+distinct values its cardinality, minimum and maximum (numbers, booleans and dates only:
+the raw dd/mm/yyyy dates are text and would not sort by date). Duplicate rows are
+counted on row hashes. Profiles are cached per file version and shared by the pages.
+"""
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from utils.loader import file_signature
+
+PROFILE_COLUMNS = ['NaN Count', '% of NaN', 'Min', 'Max', 'Unique']
+
+
+def column_profile(values):
+    "(null count, min, max, number of distinct values) of a column, from one factorization"
+    codes, uniques = pd.factorize(values, use_na_sentinel = True)
+    nulls = int(np.count_nonzero(codes == -1))
+    # Categories as their plain values, so that numeric categories (Size) get a range
+    uniques = np.asarray(uniques)
+    if not len(uniques) or uniques.dtype.kind not in 'biufmM':
+        return nulls, None, None, len(uniques)
+    uniques = pd.Index(uniques)
+    return nulls, uniques.min(), uniques.max(), len(uniques)
+
+
+def profile_frame(frame):
+    "Profile of a table: {'rows', 'columns', 'duplicates', 'table' (one row per column)}"
+    rows = len(frame)
+    table = {}
+    for col in frame.columns:
+        nulls, low, high, unique = column_profile(frame[col])
+        table[col] = {'NaN Count': nulls, '% of NaN': round(nulls / rows * 100, 2) if rows else 0.0,
+                      # As text: a column of mixed types could not be displayed
+                      'Min': '' if low is None else str(low), 'Max': '' if high is None else str(high),
+                      'Unique': unique}
+    duplicates = int(pd.util.hash_pandas_object(frame, index = False).duplicated().sum())
+    return {'rows': rows, 'columns': frame.shape[1], 'duplicates': duplicates,
+            'table': pd.DataFrame.from_dict(table, orient = 'index', columns = PROFILE_COLUMNS)}
+
+
+def missing_values(profile):
+    "Null counts and percentages of the columns that have missing values"
+    table = profile['table']
+    return table.loc[table['NaN Count'] > 0, ['NaN Count', '% of NaN']]
+
+
+@st.cache_data(show_spinner = False, max_entries = 16)
+def _cached_profile(path, signature, stage, _frame):
+    return profile_frame(_frame)
+
+
+def load_profile(path, frame, stage = 'raw'):
+    """Profile of `frame`, the content of the file at `path` (at a processing `stage`),
+    computed once per file version"""
+    return _cached_profile(path, file_signature(path), stage, frame)
@@ -0,0 +1,160 @@
+"""
+Model registry : fitted models cached in memory (LRU) and on disk (joblib)
+
+Entries are keyed on (feature list, model type, hyperparameters, data fingerprint),
+so a model is only trained again when one of them changes. When an entry is a dict
+with a 'metrics' item, the metrics are also saved to a small JSON file so they can
+be read without loading the model, and so is its 'features' item (the feature
+columns the model was trained on), so the default model of the batch and serving
+tools can be one trained on the columns they send.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+import pandas as pd
+import streamlit as st
+
+from utils.loader import atomic_write
+
+MODELS_DIR = os.environ.get("RETAIL_MODELS_DIR", "models")
+MEMORY_SLOTS = 8
+ENTRY_VERSION = 1
+
+
+def data_fingerprint(*frames):
+    "Content hash of the training data (order sensitive, independent of the file it came from)"
+    digest = hashlib.sha256()
+    for frame in frames:
+        digest.update(pd.util.hash_pandas_object(frame, index = False).to_numpy().tobytes())
+        columns = frame.columns if isinstance(frame, pd.DataFrame) else [frame.name]
+        digest.update(repr(list(columns)).encode())
+    return digest.hexdigest()
+
+
+def model_key(features, model_type, params, fingerprint):
+    "Registry key of a model specification"
+    spec = {'version': ENTRY_VERSION, 'features': list(features), 'model': model_type,
+            'params': params, 'data': fingerprint}
+    return hashlib.sha256(json.dumps(spec, sort_keys = True, default = str).encode()).hexdigest()
+
+
+class ModelRegistry:
+    "Fitted models shared by every session, with LRU eviction in memory and joblib files on disk"
+
+    def __init__(self, directory = MODELS_DIR, slots = MEMORY_SLOTS):
+        self.directory = directory
+        self.slots = slots
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key, extension = 'joblib'):
+        return os.path.join(self.directory, f"{key}.{extension}")
+
+    def get(self, key):
+        "Cached entry for `key` (memory first, then disk), or None"
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        entry = joblib.load(path)
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        "Store `entry` in memory and persist it on disk"
+        os.makedirs(self.directory, exist_ok = True)
+        atomic_write(self._path(key), lambda tmp: joblib.dump(entry, tmp))
+        # Features before metrics: an entry listed by latest_key always has its features saved
+        for item, extension in [('features', 'features'), ('metrics', 'json')]:
+            if isinstance(entry, dict) and item in entry:
+                def write_item(tmp_path):
+                    with open(tmp_path, 'w') as f:
+                        json.dump(entry[item], f)
+                atomic_write(self._path(key, extension), write_item)
+        self._remember(key, entry)
+
+    def has(self, key):
+        "Whether an entry for `key` is saved (does not load it)"
+        with self._lock:
+            if key in self._entries:
+                return True
+        return os.path.exists(self._path(key))
+
+    def progress_path(self, key):
+        "Path of the progress file of a model being trained"
+        return self._path(key, 'progress')
+
+    def metrics(self, key):
+        "Saved metrics of `key`, or None (does not load the model)"
+        try:
+            with open(self._path(key, 'json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def features(self, key):
+        "Saved feature columns of `key`, or None (does not load the model)"
+        try:
+            with open(self._path(key, 'features')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def get_or_fit(self, key, fit):
+        "Cached entry for `key`, calling `fit()` to build it on a miss"
+        entry = self.get(key)
+        if entry is None:
+            entry = fit()
+            self.put(key, entry)
+        return entry
+
+    def latest_key(self, features = None):
+        """Key of the most recently saved entry holding a pipeline, or None.
+
+        With `features`, only the entries trained on exactly these feature columns count
+        (entries saved without their feature list are skipped).
+        """
+        try:
+            keys = [name[:-len('.json')] for name in os.listdir(self.directory) if name.endswith('.json')]
+        except FileNotFoundError:
+            return None
+        if features is not None:
+            keys = [key for key in keys if self.features(key) == list(features)]
+        if not keys:
+            return None
+        return max(keys, key = lambda key: os.path.getmtime(self._path(key, 'json')))
+
+    def resolve(self, key = None, features = None):
+        """(key, entry) for `key`, or for the most recently saved model trained on `features`
+        (any model if None); entry is None if not found.
+
+        Raises ValueError when the entry of `key` was trained on other feature columns.
+        """
+        key = key or self.latest_key(features)
+        entry = self.get(key) if key else None
+        trained_on = entry.get('features') if isinstance(entry, dict) else None
+        if features is not None and trained_on is not None and trained_on != list(features):
+            raise ValueError(f"model {key} was trained on other features ({', '.join(trained_on)}), "
+                             f"not on {', '.join(features)}")
+        return key, entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.slots:
+                self._entries.popitem(last = False)
+
+
+@st.cache_resource
+def get_registry():
+    "Process-wide model registry"
+    return ModelRegistry()
@@ -0,0 +1,116 @@
+"""
+What-if scenarios : predictions over a Cartesian grid of feature values
+
+A grid is one tuple of values per model feature (stores, departments, holiday flag,
+temperatures...). Its rows are never materialized at once: chunks of flat row numbers
+are unravelled into feature columns and scored with one predict call per chunk, into
+an array with one axis per feature. Response curves and surfaces are means of that
+array over the other axes. Results are cached per model and grid.
+"""
+
+import numpy as np
+import pandas as pd
+import seaborn as sns
+import streamlit as st
+from matplotlib.figure import Figure
+
+from utils.batch import CHUNK_SIZE
+from utils.encoding import STORE_TYPES
+from utils.figures import to_png
+from utils.training import MODEL_FEATURES
+
+MAX_GRID_ROWS = 5_000_000
+STEPS = 10
+
+## Inputs swept over a numeric range (the others take a list of values)
+RANGE_INPUTS = ['Temperature', 'Fuel_Price', 'CPI', 'Unemployment']
+PREDICTION = 'Predicted Weekly_Sales'
+
+
+def make_grid(values):
+    "Grid (tuple of (feature, values) in MODEL_FEATURES order) from {feature: values}"
+    missing = [col for col in MODEL_FEATURES if not len(values.get(col, ()))]
+    if missing:
+        raise ValueError(f"No value for: {', '.join(missing)}")
+    return tuple((col, tuple(np.asarray(values[col]).tolist())) for col in MODEL_FEATURES)
+
+
+def grid_rows(grid):
+    "Number of rows (scenarios) of a grid"
+    return int(np.prod([len(values) for _, values in grid], dtype = np.int64))
+
+
+def grid_chunks(grid, chunk_size = CHUNK_SIZE):
+    "Iterate over the grid rows as feature frames of `chunk_size` rows (last axis fastest)"
+    shape = [len(values) for _, values in grid]
+    columns = [(col, np.asarray(values)) for col, values in grid]
+    total = grid_rows(grid)
+    for start in range(0, total, chunk_size):
+        positions = np.unravel_index(np.arange(start, min(start + chunk_size, total)), shape)
+        yield pd.DataFrame({col: values[position] for (col, values), position in zip(columns, positions)})
+
+
+def sweep(pipeline, grid, chunk_size = CHUNK_SIZE):
+    "Predictions of every grid row, as an array with one axis per feature"
+    total = grid_rows(grid)
+    if total > MAX_GRID_ROWS:
+        raise ValueError(f"{total:,} scenarios: the grid is limited to {MAX_GRID_ROWS:,}")
+    predictions = np.empty(total)
+    start = 0
+    for chunk in grid_chunks(grid, chunk_size):
+        predictions[start:start + len(chunk)] = pipeline.predict(chunk)
+        start += len(chunk)
+    return predictions.reshape([len(values) for _, values in grid])
+
+
+@st.cache_resource(show_spinner = False, max_entries = 8)
+def _cached_sweep(model_key, grid, _pipeline):
+    predictions = sweep(_pipeline, grid)
+    # Shared by every session
+    predictions.flags.writeable = False
+    return predictions
+
+
+def load_sweep(model_key, pipeline, grid):
+    "Predictions of a grid by the registry model `model_key`, computed once per model and grid"
+    return _cached_sweep(model_key, grid, pipeline)
+
+
+## Summaries
+
+def labels(col, values):
+    "Display values of a feature (store types as letters)"
+    return [STORE_TYPES[int(v)] for v in values] if col == 'Type' else list(values)
+
+
+def response_curve(predictions, grid, feature):
+    "Mean prediction for every value of `feature`, over all the other scenarios"
+    axis = [col for col, _ in grid].index(feature)
+    others = tuple(i for i in range(predictions.ndim) if i != axis)
+    return pd.Series(predictions.mean(axis = others), index = labels(feature, dict(grid)[feature]),
+                     name = PREDICTION).rename_axis(feature)
+
+
+def response_surface(predictions, grid, x, y):
+    "Mean prediction for every (y, x) pair of values, over all the other scenarios"
+    columns = [col for col, _ in grid]
+    ix, iy = columns.index(x), columns.index(y)
+    others = tuple(i for i in range(predictions.ndim) if i not in (ix, iy))
+    surface = predictions.mean(axis = others)
+    # Remaining axes are in grid order: put y on the rows
+    surface = surface if iy < ix else surface.T
+    values = dict(grid)
+    return pd.DataFrame(surface, index = pd.Index(labels(y, values[y]), name = y),
+                        columns = pd.Index(labels(x, values[x]), name = x))
+
+
+def surface_png(surface):
+    "Heatmap of a response surface"
+    fig = Figure(figsize = (10, 7))
+    ax = fig.subplots()
+    sns.heatmap(surface.rename(index = lambda v: f"{v:.4g}" if isinstance(v, float) else v,
+                               columns = lambda v: f"{v:.4g}" if isinstance(v, float) else v),
+                cmap = 'viridis', ax = ax, cbar_kws = {'label': PREDICTION})
+    ax.invert_yaxis()
+    ax.set_title(f"{PREDICTION} by {surface.columns.name} and {surface.index.name}")
+    return to_png(fig)
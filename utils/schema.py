@@ -0,0 +1,71 @@
+"""
+Compact schema of the merged retail dataset
+
+Keys are downcast to the smallest integer type that fits, Type and Size (repeated on
+every row of a store) become categoricals, measures become float32, flags become
+booleans (nullable only when some are missing), and IsHoliday_y is dropped once
+verified identical to IsHoliday_x.
+"""
+
+import numpy as np
+import pandas as pd
+
+MARKDOWNS = ['MarkDown1', 'MarkDown2', 'MarkDown3', 'MarkDown4', 'MarkDown5']
+MEASURES = ['Weekly_Sales', 'Temperature', 'Fuel_Price', *MARKDOWNS, 'CPI', 'Unemployment']
+
+INTEGER_KEYS = ['Store', 'Dept']
+CATEGORIES = ['Type', 'Size']
+FLAGS = ['IsHoliday_x', 'IsHoliday_y']
+
+
+def compact(merged_data):
+    "Compact copy of the merged dataset (or of any subset of its columns)"
+    data = merged_data
+    if {'IsHoliday_x', 'IsHoliday_y'} <= set(data.columns) and data['IsHoliday_x'].equals(data['IsHoliday_y']):
+        data = data.drop(columns = ['IsHoliday_y'])
+
+    columns = {}
+    for col in data.columns:
+        if col in INTEGER_KEYS:
+            columns[col] = pd.to_numeric(data[col], downcast = 'integer')
+        elif col in CATEGORIES:
+            columns[col] = data[col].astype('category')
+        elif col in FLAGS:
+            # Nullable when a flag is missing (e.g. a week without features): NaN must not become True
+            columns[col] = data[col].astype('boolean' if data[col].isna().any() else bool)
+        elif col in MEASURES:
+            columns[col] = data[col].astype('float32')
+        elif col == 'Date':
+            columns[col] = pd.to_datetime(data[col])
+        else:
+            columns[col] = data[col]
+    return pd.DataFrame(columns, index = data.index)
+
+
+def expand(compacted):
+    """Compact rows with plain columns again, e.g. to be concatenated with merged rows and compacted.
+
+    Categoricals become arrays of their values, measures float64 again (holding the exact
+    float32 values, so compacting them again gives the same values) and a dropped
+    IsHoliday_y is restored (last column: reorder as needed).
+    """
+    columns = {}
+    for col, values in compacted.items():
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            columns[col] = np.asarray(values)
+        elif col in MEASURES:
+            columns[col] = values.astype('float64')
+        else:
+            columns[col] = values
+    if 'IsHoliday_x' in columns and 'IsHoliday_y' not in columns:
+        columns['IsHoliday_y'] = columns['IsHoliday_x']
+    return pd.DataFrame(columns, index = compacted.index)
+
+
+def memory_report(before, after):
+    "Memory per column (bytes) before and after compaction, with a total row"
+    report = pd.concat([before.memory_usage(index = False, deep = True),
+                        after.memory_usage(index = False, deep = True)],
+                       axis = 1, keys = ['Before (bytes)', 'After (bytes)'])
+    report.loc['Total'] = report.sum()
+    return report.fillna(0).astype('int64')
@@ -0,0 +1,208 @@
+"""
+Prediction service : a warm model behind a small HTTP API, with micro-batching
+
+Usage : python -m utils.service [--host HOST] [--port PORT] [--model KEY]
+
+Endpoints :
+- POST /predict : a JSON object of features, or {"rows": [...]} for several rows
+- GET /stats : request count, p50/p99 latency and micro-batch sizes
+- GET /health
+
+The model pipeline is loaded from the model registry once at startup. Concurrent
+requests are queued and coalesced into micro-batches, each scored with a single
+vectorized predict call.
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from utils.batch import encode_features, resolve_model
+
+MAX_BATCH_ROWS = 4096
+MAX_WAIT_MS = 5
+LATENCY_WINDOW = 10_000
+
+
+def validate_features(X):
+    """Encoded rows as float64, raising ValueError on missing or non-numeric values.
+
+    One bad row would otherwise fail the predict call of its whole micro-batch.
+    """
+    numeric = X.apply(pd.to_numeric, errors = 'coerce').astype('float64')
+    invalid = numeric.isna()
+    if invalid.to_numpy().any():
+        details = [f"{col}: {', '.join(map(repr, X.loc[invalid[col], col].unique()[:5]))}"
+                   for col in X.columns if invalid[col].any()]
+        raise ValueError(f"Missing or non-numeric feature values ({'; '.join(details)})")
+    return numeric
+
+
+class MicroBatcher:
+    "Coalesce concurrent predict calls into one vectorized call per micro-batch"
+
+    def __init__(self, pipeline, max_rows = MAX_BATCH_ROWS, max_wait_ms = MAX_WAIT_MS):
+        self.pipeline = pipeline
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.batched_rows = 0
+        self._queue = queue.Queue()
+        threading.Thread(target = self._run, daemon = True).start()
+
+    def predict(self, X):
+        "Predictions for the encoded rows `X` (blocks until its micro-batch is scored)"
+        future = Future()
+        self._queue.put((X, future))
+        return future.result()
+
+    def _collect(self):
+        "Wait for a first request, then gather more until the batch is full or the wait is over"
+        items = [self._queue.get()]
+        rows = len(items[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_rows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout = timeout)
+            except queue.Empty:
+                break
+            items.append(item)
+            rows += len(item[0])
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            try:
+                predictions = self.pipeline.predict(pd.concat([X for X, _ in items], ignore_index = True))
+            except Exception:
+                # Score every request on its own, so an error only reaches the request causing it
+                self._run_each(items)
+                continue
+            self.batches += 1
+            self.batched_rows += len(predictions)
+            start = 0
+            for X, future in items:
+                future.set_result(predictions[start:start + len(X)])
+                start += len(X)
+
+
+    def _run_each(self, items):
+        for X, future in items:
+            try:
+                future.set_result(self.pipeline.predict(X))
+            except Exception as e:
+                future.set_exception(e)
+
+
+class LatencyTracker:
+    "Rolling window of request latencies"
+
+    def __init__(self, window = LATENCY_WINDOW):
+        self.count = 0
+        self._latencies = deque(maxlen = window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self._latencies.append(seconds * 1000)
+
+    def summary(self):
+        with self._lock:
+            latencies = np.array(self._latencies)
+        if not len(latencies):
+            return {'requests': self.count, 'p50_ms': None, 'p99_ms': None}
+        return {'requests': self.count,
+                'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                'p99_ms': round(float(np.percentile(latencies, 99)), 3)}
+
+
+class PredictionServer(ThreadingHTTPServer):
+    "Threaded HTTP server with room for bursts of concurrent clients"
+    request_queue_size = 128
+
+
+def make_handler(batcher, tracker, model_key):
+    "Request handler class bound to a batcher and a latency tracker"
+
+    class PredictionHandler(BaseHTTPRequestHandler):
+
+        def _send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == '/health':
+                self._send_json(200, {'status': 'ok', 'model': model_key})
+            elif self.path == '/stats':
+                mean_rows = batcher.batched_rows / batcher.batches if batcher.batches else None
+                self._send_json(200, {**tracker.summary(), 'batches': batcher.batches,
+                                      'mean_batch_rows': mean_rows})
+            else:
+                self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._send_json(404, {'error': f"Unknown endpoint {self.path}"})
+                return
+            start = time.perf_counter()
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                rows = payload['rows'] if isinstance(payload, dict) and 'rows' in payload else [payload]
+                X = validate_features(encode_features(pd.DataFrame(rows)))
+            except (ValueError, KeyError, TypeError) as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            try:
+                predictions = batcher.predict(X)
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+                return
+            tracker.record(time.perf_counter() - start)
+            self._send_json(200, {'predictions': predictions.tolist()})
+
+        def log_message(self, format, *args):
+            # One log line per request would dominate the latency: stay quiet
+            pass
+
+    return PredictionHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Serve Weekly_Sales predictions over HTTP.")
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8600)
+    parser.add_argument('--model', help = "registry key of the model (default: most recently trained on the base features)")
+    parser.add_argument('--max-batch-rows', type = int, default = MAX_BATCH_ROWS)
+    parser.add_argument('--max-wait-ms', type = float, default = MAX_WAIT_MS)
+    args = parser.parse_args()
+
+    key, entry = resolve_model(parser, args.model)
+
+    batcher = MicroBatcher(entry['pipeline'], args.max_batch_rows, args.max_wait_ms)
+    server = PredictionServer((args.host, args.port), make_handler(batcher, LatencyTracker(), key))
+    print(f"Serving model {key} on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+Synthetic retail data : sales, features and stores tables at any scale
+
+Usage : python -m utils.synthetic OUTPUT_DIR [--stores N] [--weeks N] [--depts N] [--seed N] [--chunk-stores N]
+
+The tables have the layout of the originals (same columns, dd/mm/yyyy dates, NA for
+missing values) and similar statistics: store types and sizes, yearly seasonality
+with the Thanksgiving and Christmas peaks, the four holiday weeks, markdowns only
+from November 2011 with the originals' sparsity, and CPI/Unemployment missing on the
+last weeks of features.csv (which, as in the originals, goes on after the sales).
+
+Stores are generated and appended to the files a block at a time, so memory stays
+bounded whatever the number of stores. The same seed and block size give the same files.
+"""
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.loader import MARKDOWNS
+
+START = '2010-02-05'
+SALES_WEEKS = 143
+FUTURE_WEEKS = 39
+MISSING_ECONOMY_WEEKS = 13
+DEPTS = 81
+DEPT_PRESENCE = 0.9
+CHUNK_STORES = 100
+
+## Week of the 52-week cycle (from START) of Super Bowl, Labor Day, Thanksgiving and Christmas
+HOLIDAY_WEEKS = [1, 31, 42, 47]
+THANKSGIVING_WEEK = 42
+SUMMER_WEEK = 24
+
+## Type: (share of the stores, size range)
+STORE_TYPES = {'A': (0.49, (150_000, 220_000)), 'B': (0.38, (35_000, 140_000)), 'C': (0.13, (39_000, 43_000))}
+
+## Markdowns: (share of the weeks with a value, mean and std of the log amount), from November 2011
+MARKDOWN_START = '2011-11-11'
+MARKDOWN_PROFILE = {'MarkDown1': (1.0, 8.0, 1.7), 'MarkDown2': (0.72, 5.8, 2.6), 'MarkDown3': (0.89, 3.6, 2.4),
+                    'MarkDown4': (0.86, 6.7, 2.0), 'MarkDown5': (1.0, 7.9, 0.9)}
+
+
+def make_stores(n_stores, rng):
+    "stores.csv table, plus the per-store profile used to generate the other tables"
+    types = rng.choice(list(STORE_TYPES), size = n_stores, p = [share for share, _ in STORE_TYPES.values()])
+    low, high = (np.array([STORE_TYPES[t][1][i] for t in types]) for i in range(2))
+    stores = pd.DataFrame({'Store': np.arange(1, n_stores + 1), 'Type': types,
+                           'Size': rng.integers(low, high + 1)})
+    profile = pd.DataFrame({
+        'temperature': rng.normal(60, 10, n_stores),
+        'temperature_amplitude': rng.uniform(10, 25, n_stores),
+        'fuel_offset': rng.normal(0, 0.1, n_stores),
+        'cpi': np.where(rng.random(n_stores) < 0.5, rng.normal(130, 3, n_stores), rng.normal(210, 4, n_stores)),
+        'unemployment': rng.uniform(4, 12, n_stores),
+        'level': stores['Size'] / stores['Size'].mean() * rng.lognormal(0, 0.3, n_stores),
+    })
+    return stores, profile
+
+
+def seasonality(t):
+    "Yearly sales factor of week numbers `t`: mild summer, Thanksgiving peak, December ramp-up"
+    cycle = t % 52
+    factor = 1 + 0.05 * np.cos(2 * np.pi * (t - SUMMER_WEEK) / 52)
+    factor = factor + np.where(cycle == THANKSGIVING_WEEK, 0.45, 0)
+    return factor + np.where((cycle > THANKSGIVING_WEEK) & (cycle < 47), 0.1 * (cycle - THANKSGIVING_WEEK), 0)
+
+
+def make_features(profile, dates, fuel, rng):
+    "features.csv rows of a block of stores (profile rows), for every week of `dates`"
+    n_stores, n_weeks = len(profile), len(dates)
+    t = np.arange(n_weeks)
+    shape = (n_stores, n_weeks)
+
+    def column(values):
+        return values.reshape(-1)
+
+    temperature = (profile['temperature'].to_numpy()[:, None]
+                   + profile['temperature_amplitude'].to_numpy()[:, None] * np.cos(2 * np.pi * (t - SUMMER_WEEK) / 52)
+                   + rng.normal(0, 5, shape))
+    cpi = profile['cpi'].to_numpy()[:, None] * (1 + 0.0004 * t) + rng.normal(0, 0.1, shape)
+    unemployment = np.clip(profile['unemployment'].to_numpy()[:, None] - 0.01 * t + rng.normal(0, 0.1, shape), 3, None)
+    # The last weeks of the originals have no economic data yet
+    cpi[:, n_weeks - MISSING_ECONOMY_WEEKS:] = np.nan
+    unemployment[:, n_weeks - MISSING_ECONOMY_WEEKS:] = np.nan
+
+    features = {'Store': np.repeat(profile.index.to_numpy() + 1, n_weeks),
+                'Date': np.tile(dates.strftime('%d/%m/%Y'), n_stores),
+                'Temperature': column(temperature).round(2),
+                'Fuel_Price': column(fuel[None, :] + profile['fuel_offset'].to_numpy()[:, None]).round(3)}
+    promoted = np.broadcast_to(dates >= pd.Timestamp(MARKDOWN_START), shape)
+    for col in MARKDOWNS:
+        share, mean, std = MARKDOWN_PROFILE[col]
+        present = promoted & (rng.random(shape) < share)
+        features[col] = column(np.where(present, rng.lognormal(mean, std, shape), np.nan)).round(2)
+    features['CPI'] = column(cpi).round(7)
+    features['Unemployment'] = column(unemployment).round(3)
+    features['IsHoliday'] = np.tile(np.isin(t % 52, HOLIDAY_WEEKS), n_stores)
+    return pd.DataFrame(features)
+
+
+def make_sales(profile, dates, depts, rng):
+    "sales.csv rows of a block of stores: every present (Store, Dept) series on every week of `dates`"
+    n_stores, n_weeks = len(profile), len(dates)
+    t = np.arange(n_weeks)
+    level, strength = depts
+    present = rng.random((n_stores, len(level))) < DEPT_PRESENCE
+    store, dept = np.nonzero(present)
+
+    # (series, week) grid of the present departments
+    base = profile['level'].to_numpy()[store] * level[dept]
+    seasonal = 1 + strength[dept][:, None] * (seasonality(t)[None, :] - 1)
+    sales = base[:, None] * seasonal * rng.lognormal(0, 0.15, (len(store), n_weeks))
+    return pd.DataFrame({'Store': np.repeat(profile.index.to_numpy()[store] + 1, n_weeks),
+                         'Dept': np.repeat(dept + 1, n_weeks),
+                         'Date': np.tile(dates.strftime('%d/%m/%Y'), len(store)),
+                         'Weekly_Sales': sales.reshape(-1).round(2),
+                         'IsHoliday': np.tile(np.isin(t % 52, HOLIDAY_WEEKS), len(store))})
+
+
+def write_csv(table, path, first):
+    "Write (first block) or append a table, in the originals' CSV conventions"
+    table = table.assign(IsHoliday = np.where(table['IsHoliday'], 'TRUE', 'FALSE'))
+    table.to_csv(path, index = False, na_rep = 'NA', header = first, mode = 'w' if first else 'a')
+
+
+def generate(directory, n_stores, weeks = SALES_WEEKS, n_depts = DEPTS, seed = 0, chunk_stores = CHUNK_STORES):
+    "Write sales.csv, features.csv and stores.csv to `directory`; returns the number of sales rows"
+    os.makedirs(directory, exist_ok = True)
+    rng = np.random.default_rng(seed)
+    stores, profile = make_stores(n_stores, rng)
+    stores.to_csv(os.path.join(directory, "stores.csv"), index = False)
+
+    # Chain-wide parts: the fuel price path and the department mix
+    dates = pd.date_range(START, periods = weeks + FUTURE_WEEKS, freq = '7D')
+    fuel = 2.6 + np.cumsum(rng.normal(0.007, 0.04, len(dates)))
+    mix = rng.lognormal(0, 1, n_depts)
+    depts = (20_000 * mix / mix.mean(), rng.uniform(0, 1.5, n_depts))
+
+    rows = 0
+    for block, start in enumerate(range(0, n_stores, chunk_stores)):
+        block_rng = np.random.default_rng([seed, block])
+        block_profile = profile.iloc[start:start + chunk_stores]
+        first = block == 0
+        write_csv(make_features(block_profile, dates, fuel, block_rng),
+                  os.path.join(directory, "features.csv"), first)
+        sales = make_sales(block_profile, dates[:weeks], depts, block_rng)
+        write_csv(sales, os.path.join(directory, "sales.csv"), first)
+        rows += len(sales)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Generate synthetic sales, features and stores CSV files.")
+    parser.add_argument('directory', help = "output directory (e.g. a RETAIL_DATA_DIR for the app)")
+    parser.add_argument('--stores', type = int, default = 1000)
+    parser.add_argument('--weeks', type = int, default = SALES_WEEKS, help = "weeks of sales history")
+    parser.add_argument('--depts', type = int, default = DEPTS, help = "departments per store (at most)")
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--chunk-stores', type = int, default = CHUNK_STORES, help = "stores generated per block")
+    args = parser.parse_args()
+
+    rows = generate(args.directory, args.stores, args.weeks, args.depts, args.seed, args.chunk_stores)
+    print(f"{args.stores:,} stores, {rows:,} sales rows written to {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
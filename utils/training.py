@@ -0,0 +1,77 @@
+"""
+Model training : Random Forest grown in parallel batches, histogram gradient boosting
+"""
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
+
+## Features used by every model (Type as category codes)
+MODEL_FEATURES = ['Store', 'Dept', 'IsHoliday_x', 'Temperature', 'Fuel_Price', 'CPI', 'Unemployment', 'Type']
+
+## Presets: "Compact" bounds the size of every tree so the forest's memory stays predictable
+FOREST_PRESETS = {
+    "Compact (float32, bounded depth)": {'params': {'max_depth': 20, 'min_samples_leaf': 5, 'max_samples': 0.5},
+                                         'float32': True},
+    "Full (unbounded depth)": {'params': {}, 'float32': False},
+}
+
+BATCH_SIZE = 10
+PATIENCE = 2
+TOLERANCE = 1e-3
+
+
+def make_forest(preset, n_estimators = 100, random_state = 42):
+    "Random Forest configured for batched, parallel growth"
+    return RandomForestRegressor(n_estimators = n_estimators, random_state = random_state,
+                                 warm_start = True, oob_score = True, n_jobs = -1,
+                                 **FOREST_PRESETS[preset]['params'])
+
+
+def grow_forest(forest, X, y, preset, batch_size = BATCH_SIZE, patience = PATIENCE,
+                tolerance = TOLERANCE, callback = None):
+    """Grow `forest` up to its n_estimators, `batch_size` trees at a time.
+
+    Stops early once the out-of-bag R² improved by less than `tolerance` for
+    `patience` batches in a row. `callback(fraction, message)` is called after
+    every batch (e.g. to drive a progress bar).
+    """
+    if FOREST_PRESETS[preset]['float32']:
+        # Trees work in float32 anyway: converting once avoids a float64 copy per fit
+        X = np.asarray(X, dtype = np.float32)
+        y = np.asarray(y, dtype = np.float32)
+
+    target = forest.n_estimators
+    best, stale = -np.inf, 0
+    for n_trees in range(min(batch_size, target), target + batch_size, batch_size):
+        n_trees = min(n_trees, target)
+        forest.set_params(n_estimators = n_trees)
+        forest.fit(X, y)
+
+        score = forest.oob_score_
+        stale = stale + 1 if score - best < tolerance else 0
+        best = max(best, score)
+        if callback is not None:
+            callback(n_trees / target, f"{n_trees}/{target} trees, out-of-bag R²: {score:.3f}")
+        if stale >= patience or n_trees == target:
+            break
+
+    # Training is over: make further fit() calls start from scratch
+    forest.set_params(warm_start = False)
+    return forest
+
+
+## Histogram gradient boosting
+CATEGORICAL_FEATURES = ['Store', 'Dept', 'Type']
+MAX_BINS = 255
+
+
+def make_boosting(X, random_state = 42):
+    """Histogram gradient boosting with native categorical handling (no scaling needed).
+
+    Integer-coded columns of CATEGORICAL_FEATURES are treated as categories when their
+    codes fit in the histogram bins; larger ones stay numerical.
+    """
+    categorical = [col for col in CATEGORICAL_FEATURES
+                   if col in X.columns and X[col].min() >= 0 and X[col].max() < MAX_BINS]
+    return HistGradientBoostingRegressor(categorical_features = categorical or None,
+                                         max_bins = MAX_BINS, random_state = random_state)
@@ -0,0 +1,17 @@
+"""
+Worker processes : process pools started safely from the Streamlit server
+
+Streamlit runs its sessions in threads, and forking a multi-threaded process can
+deadlock the child on a lock held by another thread. Pools are therefore made of
+fresh (spawned) processes; they import the main script as `__mp_main__`, which is
+why app.py only renders a page when it is not imported that way.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+
+def process_pool(workers, initializer = None, initargs = ()):
+    "Pool of `workers` spawned processes, each running initializer(*initargs) first"
+    return ProcessPoolExecutor(max_workers = workers, initializer = initializer, initargs = initargs,
+                               mp_context = multiprocessing.get_context('spawn'))